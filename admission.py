@@ -0,0 +1,288 @@
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from http import HTTPStatus
+
+from flask import g, request
+
+from cache import in_event_loop, wait_in_event_loop
+from profiling import add_server_timing, timed
+
+logger = logging.getLogger('smilecook.admission')
+
+
+# 超出限制时抛出 由before_request或资源转换为429/503响应
+class AdmissionRejected(Exception):
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def response(self):
+        return {'message': self.message}, self.status, {'Retry-After': str(self.retry_after)}
+
+
+# 同时处理的请求数上限 超出时最多queue_size个请求等待timeout秒 队列已满时立即拒绝
+# 每个worker进程单独计数 限制的是本进程的线程和CPU
+class ConcurrencyLimiter:
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active + self.waiting >= self.limit + self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+        if in_event_loop():
+            acquired = wait_in_event_loop(lambda: self._slots.acquire(blocking=False), self.timeout)
+        else:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+                self.admitted += 1
+            else:
+                self.timed_out += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'queue_size': self.queue_size, 'active': self.active,
+                    'waiting': self.waiting, 'admitted': self.admitted, 'rejected': self.rejected,
+                    'timed_out': self.timed_out}
+
+
+# 令牌桶 返回需要等待的秒数 0表示取得令牌
+def refill(tokens, updated_at, rate, burst, now):
+    if tokens is None:
+        tokens = burst
+    else:
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+# 单进程使用
+class MemoryRateLimitStore:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (None, now))
+            tokens, wait = refill(tokens, updated_at, rate, burst, now)
+            self._buckets[key] = (tokens, now)
+            return wait
+
+    def purge(self, before):
+        with self._lock:
+            self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[1] >= before}
+
+
+# 多个worker进程共享的SQLite(WAL)文件 读取和更新在同一个写事务中
+class SqliteRateLimitStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS token_bucket '
+                                   '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated_at FROM token_bucket WHERE key = ?', (key, )).fetchone()
+            tokens, wait = refill(row[0] if row else None, row[1] if row else now, rate, burst, now)
+            connection.execute('INSERT OR REPLACE INTO token_bucket (key, tokens, updated_at) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def purge(self, before):
+        self._connection().execute('DELETE FROM token_bucket WHERE updated_at < ?', (before, ))
+
+
+# 准入控制 登录、上传、搜索等开销大的请求按类别限制 避免占满worker导致所有路由变慢
+# 每个类别: 每个客户端(IP)的令牌桶 超出时返回429 以及同时处理数和等待队列 超出时返回503 都带有Retry-After
+# ADMISSION_ENDPOINTS中的路由在before_request中检查 其他位置(例如缓存未命中的搜索)使用limit(name)
+# 每次判断的结果和当时的状态写入Server-Timing的admission-<类别> 拒绝时写入smilecook.admission日志
+# 开启PROFILING_ENABLED时 等待时间计入Server-Timing的admission 状态也写入smilecook.profile日志(g.admission)
+class AdmissionControl:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.classes = {}
+        self.limiters = {}
+        self.endpoints = {}
+        self.store = None
+        self.purge_interval = 600
+        self._last_purge = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_ENABLED', True)
+        app.config.setdefault('ADMISSION_CLASSES', {})
+        app.config.setdefault('ADMISSION_ENDPOINTS', {})
+        app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', 2)
+        app.config.setdefault('ADMISSION_RATE_BACKEND', 'sqlite')
+        app.config.setdefault('ADMISSION_RATE_PATH', '/tmp/smilecook-ratelimit.db')
+        app.config.setdefault('ADMISSION_RATE_PURGE_INTERVAL', 600)
+        self.app = app
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self.classes = app.config['ADMISSION_CLASSES']
+        self.limiters = {name: ConcurrencyLimiter(options['concurrency'], options['queue_size'],
+                                                  app.config['ADMISSION_QUEUE_TIMEOUT'])
+                         for name, options in self.classes.items()}
+        self.endpoints = app.config['ADMISSION_ENDPOINTS']
+        self.purge_interval = app.config['ADMISSION_RATE_PURGE_INTERVAL']
+        self.store = None
+        app.extensions['admission_control'] = self
+        if not self.enabled:
+            return
+        if app.config['ADMISSION_RATE_BACKEND'] == 'sqlite':
+            self.store = SqliteRateLimitStore(app.config['ADMISSION_RATE_PATH'])
+        else:
+            self.store = MemoryRateLimitStore()
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def before_request(self):
+        name = self.endpoints.get((request.endpoint, request.method))
+        if name is None:
+            return None
+        try:
+            self.acquire(name)
+        except AdmissionRejected as exc:
+            return exc.response()
+        g.admission_slot = name
+        return None
+
+    # 本请求的判断结果和该类别的状态写入Server-Timing 与是否开启PROFILING_ENABLED无关
+    def after_request(self, response):
+        admission = g.get('admission')
+        if admission is not None:
+            add_server_timing(response, 'admission-{};desc="{}"'.format(admission['name'], ' '.join(
+                '{}={}'.format(key, value) for key, value in admission.items() if key != 'name')))
+        return response
+
+    def teardown_request(self, exc):
+        name = g.pop('admission_slot', None)
+        if name is not None:
+            self.limiters[name].release()
+
+    # 取得名为name的类别的令牌和处理名额 否则抛出AdmissionRejected
+    def acquire(self, name):
+        self.throttle(name)
+        self.acquire_slot(name)
+
+    # 当前客户端的令牌 超出时抛出429 未开启时不做任何事
+    # 合并的请求(SingleFlight)中由各请求在合并之前调用 不能把一个客户端的429传给其他客户端
+    def throttle(self, name):
+        if not self.enabled or name not in self.classes:
+            return
+        with timed('admission'):
+            wait = self._take_token(name)
+        if wait > 0:
+            self._record(name, 'throttled')
+            raise AdmissionRejected(HTTPStatus.TOO_MANY_REQUESTS, 'Too many requests, please try again later',
+                                    math.ceil(wait))
+
+    # 本进程中的处理名额 所有客户端共用 超出时抛出503
+    def acquire_slot(self, name):
+        limiter = self.limiters[name]
+        with timed('admission'):
+            acquired = limiter.acquire()
+        if not acquired:
+            self._record(name, 'shed')
+            raise AdmissionRejected(HTTPStatus.SERVICE_UNAVAILABLE, 'Server busy, please try again later',
+                                    max(1, math.ceil(limiter.timeout)))
+        self._record(name, 'admitted')
+
+    def release(self, name):
+        self.limiters[name].release()
+
+    # 在代码块中占用名为name的类别的名额(不检查令牌 见throttle) 未开启时不做任何事
+    def limit(self, name):
+        return _Slot(self, name if self.enabled and name in self.classes else None)
+
+    # 各类别在本进程中的状态
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+    # 存储不可用时不限制 避免影响登录等请求
+    def _take_token(self, name):
+        options = self.classes[name]
+        if not options.get('rate'):
+            return 0
+        now = time.time()
+        try:
+            wait = self.store.take('{}:{}'.format(name, request.remote_addr), options['rate'], options['burst'], now)
+            if time.monotonic() - self._last_purge > self.purge_interval:
+                self._purge(now)
+        except sqlite3.Error:
+            logger.exception('Rate limit store is unavailable')
+            return 0
+        return wait
+
+    # 桶装满后的记录与不存在时等价 可以删除
+    def _purge(self, now):
+        self._last_purge = time.monotonic()
+        horizon = max((options['burst'] / options['rate'] for options in self.classes.values() if options.get('rate')),
+                      default=0)
+        self.store.purge(now - horizon)
+
+    def _record(self, name, result):
+        g.admission = dict(self.limiters[name].stats(), name=name, result=result)
+        if result != 'admitted':
+            logger.info(json.dumps(g.admission))
+
+
+class _Slot:
+    def __init__(self, admission, name):
+        self.admission = admission
+        self.name = name
+
+    def __enter__(self):
+        if self.name is not None:
+            self.admission.acquire_slot(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.name is not None:
+            self.admission.release(self.name)
@@ -3,21 +3,28 @@ from flask_migrate import Migrate
 from flask_restful import Api
 from flask_uploads import configure_uploads, patch_request_class
 
-from extensions import db, jwt, image_set
+from extensions import db, jwt, image_set, response_cache, image_queue, token_blocklist, \
+    outbox_sender, password_hasher, media_urls, profiler, image_reclaimer, admission_control
 from config import Config
+from models.recipe import Recipe
 from extensions import db
-from resources.recipe import RecipeListResource, RecipeResource, RecipePublishResource, RecipeCoverUploadResource
+from resources.recipe import RecipeListResource, RecipeResource, RecipePublishResource, RecipeCoverUploadResource, \
+    RecipeBulkResource, RecipeBatchGetResource
 from resources.user import UserListResource, UserResource, MeResource, UserRecipeListResource, UserActivateResource, \
-    UserAvatarUploadResource
-from resources.token import TokenResource, RefreshResource, black_list, RevokeResource
+    UserAvatarUploadResource, UserRecipeExportResource
+from resources.image_job import ImageJobResource
+from resources.token import TokenResource, RefreshResource, RevokeResource
+from utils import UploadRequest
 
 
-def create_app():
+def create_app(config=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config)
+    app.request_class = UploadRequest
 
     register_extensions(app)
     register_resources(app)
+    register_commands(app)
 
     return app
 
@@ -30,11 +37,33 @@ def register_extensions(app):
     configure_uploads(app, image_set)
     # 允许上传的最大文件大小  10MB
     patch_request_class(app, 10 * 1024 * 1024)
+    response_cache.init_app(app)
+    image_queue.init_app(app)
+    token_blocklist.init_app(app)
+    outbox_sender.init_app(app)
+    password_hasher.init_app(app)
+    media_urls.init_app(app)
+    profiler.init_app(app)
+    image_reclaimer.init_app(app)
+    # 在profiler之后注册 等待时间计入本次请求的统计
+    admission_control.init_app(app)
 
     @jwt.token_in_blocklist_loader
     def check_if_token_in_revoked(jwt_header, jwt_payload):
         jti = jwt_payload['jti']
-        return jti in black_list
+        return token_blocklist.is_revoked(jti)
+
+
+def register_commands(app):
+    # flask repair-recipe-counts 按recipe表重新计算用户的recipe计数
+    @app.cli.command('repair-recipe-counts')
+    def repair_recipe_counts():
+        print('Repaired recipe counts of {} users'.format(Recipe.repair_user_counts()))
+
+    # flask reclaim-images 立即删除不再被引用且超过宽限期的图像
+    @app.cli.command('reclaim-images')
+    def reclaim_images():
+        print('Reclaimed {} images'.format(image_reclaimer.reclaim()))
 
 
 def register_resources(app):
@@ -42,6 +71,7 @@ def register_resources(app):
     api.add_resource(UserListResource, '/users')
     api.add_resource(UserResource, '/users/<string:username>')
     api.add_resource(UserRecipeListResource, '/users/<string:username>/recipes')
+    api.add_resource(UserRecipeExportResource, '/users/<string:username>/recipes/export')
 
     api.add_resource(TokenResource, '/token')
     api.add_resource(RefreshResource, '/refresh')
@@ -50,6 +80,8 @@ def register_resources(app):
     api.add_resource(MeResource, '/me')
 
     api.add_resource(RecipeListResource, '/recipes')
+    api.add_resource(RecipeBulkResource, '/recipes/bulk')
+    api.add_resource(RecipeBatchGetResource, '/recipes/batch-get')
     api.add_resource(RecipeResource, '/recipes/<int:recipe_id>')
     api.add_resource(RecipePublishResource, '/recipes/<int:recipe_id>/publish')
 
@@ -57,6 +89,7 @@ def register_resources(app):
 
     api.add_resource(UserAvatarUploadResource, '/users/avatar')
     api.add_resource(RecipeCoverUploadResource, '/recipes/<int:recipe_id>/cover')
+    api.add_resource(ImageJobResource, '/images/jobs/<string:job_id>')
 
 
 if __name__ == '__main__':
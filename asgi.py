@@ -0,0 +1,181 @@
+"""ASGI入口 只读路由在事件循环中处理 其他路由交给同步app
+
+uvicorn --factory asgi:create_asgi_app --workers 4
+
+ASYNC_ENDPOINTS中的GET请求: 与同步app执行相同的视图、before/after_request和错误处理
+数据库访问使用asyncio引擎(asyncpg/aiosqlite 见database.AsyncDatabase) 等待数据库时不占用线程
+其他请求在线程池(ASYNC_WSGI_THREADS)中由create_app()的WSGI app处理 与gunicorn部署时相同
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import ClientDisconnected, HTTPException
+
+from app import create_app
+from config import Config
+from database import AsyncDatabase
+from extensions import db
+
+
+# ASGI scope -> WSGI environ body为wsgi.input
+def build_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope['http_version']),
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_{}'.format(name)
+        value = value.decode('latin-1')
+        environ[name] = '{},{}'.format(environ[name], value) if name in environ else value
+    return environ
+
+
+# 请求体 工作线程读取时才在事件循环中receive()下一块 内存中最多保留一块
+# 上传(UploadRequest写入临时文件)和批量导入(逐行读取)与gunicorn部署时一样不缓存整个请求体
+class ReceiveStream(io.RawIOBase):
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.chunk = memoryview(b'')
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            self.chunk = memoryview(message.get('body', b''))
+            self.more_body = message.get('more_body', False)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class AsyncReadApp:
+    def __init__(self, app):
+        self.app = app
+        self.endpoints = set(app.config['ASYNC_ENDPOINTS'])
+        self.database = AsyncDatabase(db, app)
+        self.executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_WSGI_THREADS'],
+                                           thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if scope['method'] in ('GET', 'HEAD'):
+            environ = build_environ(scope, io.BytesIO())
+            if self.match(environ) in self.endpoints:
+                return await self.dispatch(environ, send)
+        return await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.dispose()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # 返回endpoint 无法匹配(404/405/重定向)时返回None 由同步app处理
+    def match(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        return endpoint
+
+    # 与Flask.wsgi_app相同 请求上下文在本协程中 视图在AsyncSession.run_sync()中执行
+    async def dispatch(self, environ, send):
+        with self.app.request_context(environ):
+            response = await self.database.run(self.full_dispatch_request)
+            app_iter, status, headers = response.get_wsgi_response(environ)
+            await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                        'headers': encode_headers(headers)})
+            try:
+                for chunk in app_iter:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            await send({'type': 'http.response.body'})
+
+    def full_dispatch_request(self):
+        try:
+            return self.app.full_dispatch_request()
+        except Exception as exc:
+            return self.app.make_response(self.app.handle_exception(exc))
+
+    # 在线程池中执行WSGI app 请求体在读取时逐块接收 响应体逐块发回事件循环
+    async def call_wsgi(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, io.BufferedReader(ReceiveStream(receive, loop), 64 * 1024))
+        # chunked请求没有Content-Length 告诉Werkzeug读取到请求体结束 否则视为空
+        if 'CONTENT_LENGTH' not in environ:
+            environ['wsgi.input_terminated'] = True
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            # 第一块响应体之前才发送状态和响应头
+            start = {}
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and start.get('sent'):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                start['message'] = {'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                                    'headers': encode_headers(headers)}
+
+            def send_start():
+                if not start.get('sent'):
+                    start['sent'] = True
+                    send_from_thread(start['message'])
+
+            app_iter = self.app(environ, start_response)
+            try:
+                for chunk in app_iter:
+                    if chunk:
+                        send_start()
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            send_start()
+            send_from_thread({'type': 'http.response.body'})
+
+        await loop.run_in_executor(self.executor, run)
+
+
+def create_asgi_app(config=Config):
+    return AsyncReadApp(create_app(config))
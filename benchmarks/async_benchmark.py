@@ -0,0 +1,233 @@
+"""同步(线程池)与ASGI(asyncio)两种模式下 只读路由的吞吐量和延迟随并发连接数的变化
+
+python -m benchmarks.async_benchmark [--connections 8,32,128,256] [--duration 5] [--threads 8]
+                                     [--db-latency-ms 20] [--database-uri URI] [--output async_benchmark.json]
+
+在临时数据库(默认SQLite)中写入与load_benchmark相同的数据 服务器在子进程中运行:
+  threaded: create_app() 固定数量的线程(--threads 与gunicorn --threads相同) 每个请求占用一个线程直到返回
+  async:    asgi.AsyncReadApp (uvicorn 单个worker) ASYNC_ENDPOINTS在事件循环中处理
+客户端为asyncio 每个连接依次发送GET /recipes、/recipes?q=、/recipes/<id>、/users/<username>、/users/<username>/recipes
+--db-latency-ms 在每条SQL执行前等待 模拟PostgreSQL的网络往返(async模式下等待时让出事件循环) 为0时不模拟
+关闭了响应缓存和准入控制 每个请求都访问数据库 客户端与服务器在同一台机器上 共享CPU
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.util import await_only
+from werkzeug.serving import BaseWSGIServer
+
+from app import create_app
+from benchmarks.load_benchmark import USERS, WORDS, QuietRequestHandler, make_config, percentile, seed, git_commit
+from cache import in_event_loop
+from extensions import db
+
+
+def make_read_config(database_uri):
+    class ReadBenchmarkConfig(make_config(database_uri)):
+        RESPONSE_CACHE_BACKEND = None
+    return ReadBenchmarkConfig
+
+
+# 模拟数据库的网络延迟
+def add_latency(seconds):
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def delay(conn, cursor, statement, parameters, context, executemany):
+        if in_event_loop():
+            await_only(asyncio.sleep(seconds))
+        else:
+            time.sleep(seconds)
+
+
+# 固定大小的线程池 连接数超过线程数时在队列中等待
+class PooledWSGIServer(BaseWSGIServer):
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietRequestHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+# 子进程 数据库已由父进程写入
+def serve(mode, database_uri, port, threads, latency):
+    app = create_app(make_read_config(database_uri))
+    if latency:
+        add_latency(latency)
+    if mode == 'threaded':
+        PooledWSGIServer('127.0.0.1', port, app, threads).serve_forever()
+    else:
+        import uvicorn
+        from asgi import AsyncReadApp
+        uvicorn.run(AsyncReadApp(app), host='127.0.0.1', port=port, log_level='warning', backlog=1024)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not start on port {}'.format(port))
+
+
+def read_paths(rng, published):
+    user = 'user{}'.format(rng.randint(1, USERS))
+    return rng.choice([
+        '/recipes?page={}'.format(rng.randint(1, 20)),
+        '/recipes?q={}'.format(rng.choice(WORDS)),
+        '/recipes/{}'.format(rng.choice(published)),
+        '/users/{}'.format(user),
+        '/users/{}/recipes'.format(user),
+    ])
+
+
+# 每个请求一个连接(Connection: close) 返回状态码
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write('GET {} HTTP/1.1\r\nHost: 127.0.0.1:{}\r\nConnection: close\r\n\r\n'.format(
+            path, port).encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+    finally:
+        writer.close()
+    return int(status_line.split(b' ', 2)[1])
+
+
+async def drive(port, connections, duration, published, seed_value):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def connection(index):
+        nonlocal errors
+        rng = random.Random(seed_value + index)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, read_paths(rng, published))
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[connection(index) for index in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'connections': connections,
+        'count': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    # 子进程使用同一个数据库
+    database_uri = args.database_uri or 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'async.db'))
+    app = create_app(make_read_config(database_uri))
+    with app.app_context():
+        db.create_all()
+        published = seed(rng)
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for mode in ('threaded', 'async'):
+        port = free_port()
+        process = context.Process(target=serve, args=(mode, database_uri, port, args.threads,
+                                                      args.db_latency_ms / 1000), daemon=True)
+        process.start()
+        try:
+            wait_for_port(port)
+            # 预热 建立连接池
+            asyncio.run(drive(port, 4, 1, published, args.seed))
+            results[mode] = [asyncio.run(drive(port, connections, args.duration, published, args.seed))
+                             for connections in args.connections]
+        finally:
+            process.terminate()
+            process.join()
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'database': make_url(database_uri).get_backend_name(),
+            'threads': args.threads,
+            'db_latency_ms': args.db_latency_ms,
+            'duration_s': args.duration,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def print_results(results):
+    print('{:<10}{:>12}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('mode', 'connections', 'requests', 'errors',
+                                                                 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for mode, rows in results['results'].items():
+        for row in rows:
+            print('{:<10}{:>12}{:>10}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+                mode, row['connections'], row['count'], row['errors'], row['throughput_rps'],
+                row['p50_ms'], row['p95_ms'], row['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Threaded vs ASGI concurrent-connection benchmark')
+    parser.add_argument('--connections', type=lambda value: [int(item) for item in value.split(',')],
+                        default=[8, 32, 128, 256])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--db-latency-ms', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--output', default='async_benchmark.json')
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('results saved to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
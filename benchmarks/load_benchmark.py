@@ -0,0 +1,465 @@
+"""端到端HTTP压测 覆盖register_resources中注册的每个路由
+
+python -m benchmarks.load_benchmark [--requests 2000] [--concurrency 8] [--output results.json]
+                                    [--compare baseline.json] [--threshold 0.2] [--database-uri URI]
+
+在临时数据库(默认SQLite)中写入数据 用create_app()启动本地HTTP服务器(werkzeug 多线程)
+多个客户端线程按权重混合发送请求: 匿名检索和浏览、登录后的增删改、发布/取消发布、上传图像等
+按路由统计吞吐量和 p50/p95/p99 延迟 结果保存为JSON
+--compare 与之前保存的结果对比 p95延迟增加超过threshold(默认20%)或吞吐量下降超过threshold时退出码为1
+样本数太少的路由波动大 不参与对比 需要对比全部路由时增加--requests
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from PIL import Image
+from sqlalchemy.engine import make_url
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from app import create_app
+from config import Config
+from extensions import db, image_queue, password_hasher
+from models.recipe import Recipe
+from models.user import User
+from utils import hash_password, generate_token
+
+USERS = 50
+RECIPES = 5000
+PASSWORD = 'benchmark-password'
+# 样本数少于该值的路由不参与对比
+MIN_COMPARE_SAMPLES = 20
+WORDS = ['rice', 'curry', 'soup', 'tomato', 'onion', 'garlic', 'coconut', 'bean', 'chicken', 'noodle',
+         'salad', 'lemon', 'ginger', 'cheese', 'potato', 'mushroom', 'tofu', 'basil', 'honey', 'pumpkin']
+
+
+def make_config(database_uri):
+    workdir = tempfile.mkdtemp()
+
+    class BenchmarkConfig(Config):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = database_uri or 'sqlite:///{}'.format(os.path.join(workdir, 'load.db'))
+        UPLOADED_IMAGES_DEST = os.path.join(workdir, 'images')
+        JWT_BLOCKLIST_PATH = os.path.join(workdir, 'blocklist.db')
+        MAIL_OUTBOX_ENABLED = False
+        # 所有请求来自同一IP 不限流
+        ADMISSION_ENABLED = False
+    return BenchmarkConfig
+
+
+def phrase(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def seed(rng):
+    password = hash_password(PASSWORD)
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'password': password,
+         'is_active': True} for i in range(1, USERS + 1)])
+    db.session.commit()
+    for start in range(0, RECIPES, 1000):
+        Recipe.bulk_insert([{'name': phrase(rng, 3), 'description': phrase(rng, 8), 'ingredients': phrase(rng, 12),
+                             'directions': phrase(rng, 20), 'num_of_servings': rng.randint(1, 10),
+                             'cook_time': rng.randint(5, 120), 'user_id': rng.randint(1, USERS),
+                             'is_publish': rng.random() < 0.7} for _ in range(start, min(start + 1000, RECIPES))])
+    return [recipe_id for recipe_id, in db.session.query(Recipe.id).filter_by(is_publish=True)]
+
+
+def make_jpeg(rng):
+    image = Image.effect_noise((640, 480), 60).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80 + rng.randint(0, 10))
+    return buffer.getvalue()
+
+
+class Client:
+    """每个线程一个客户端 使用一个用户 记录自己创建的recipe和图像任务"""
+
+    def __init__(self, base_url, user_id, rng, shared):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.user_id = user_id
+        self.username = 'user{}'.format(user_id)
+        self.email = 'user{}@example.com'.format(user_id)
+        self.rng = rng
+        self.shared = shared
+        self.recipes = []
+        self.jobs = []
+        self.access_token = None
+        self.refresh_token = None
+
+    # duration: 从发出请求到读完响应体的时间
+    def request(self, method, path, **kwargs):
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, **kwargs)
+        response.duration = time.perf_counter() - start
+        return response
+
+    def auth(self, token=None):
+        return {'Authorization': 'Bearer {}'.format(token or self.access_token)}
+
+    def login(self):
+        response = self.request('POST', '/token', json={'email': self.email, 'password': PASSWORD})
+        if response.status_code == 200:
+            self.access_token = response.json()['access_token']
+            self.refresh_token = response.json()['refresh_token']
+        return response
+
+    def own_recipe(self):
+        if not self.recipes:
+            self.create_recipe()
+        return self.rng.choice(self.recipes)
+
+    def create_recipe(self):
+        response = self.request('POST', '/recipes', headers=self.auth(),
+                                json={'name': phrase(self.rng, 3), 'description': phrase(self.rng, 6),
+                                      'ingredients': phrase(self.rng, 10), 'directions': phrase(self.rng, 15),
+                                      'num_of_servings': self.rng.randint(1, 10),
+                                      'cook_time': self.rng.randint(5, 120)})
+        if response.status_code == 201:
+            self.recipes.append(response.json()['id'])
+        return response
+
+
+# (名称, 路由, 权重, 期望的状态码, 函数)
+# 名称即统计结果中的key 函数返回本次计时的响应 准备工作(例如先创建recipe)不计时
+def scenario_search(client):
+    return client.request('GET', '/recipes', params={'q': phrase(client.rng, client.rng.randint(1, 2))})
+
+
+def scenario_list(client):
+    return client.request('GET', '/recipes', params={'page': client.rng.randint(1, 5),
+                                                     'sort': client.rng.choice(['created_at', 'cook_time'])})
+
+
+def scenario_list_cursor(client):
+    return client.request('GET', '/recipes', params={'cursor': '', 'sort': 'created_at'})
+
+
+def scenario_recipe(client):
+    return client.request('GET', '/recipes/{}'.format(client.rng.choice(client.shared['published'])))
+
+
+def scenario_batch_get(client):
+    return client.request('POST', '/recipes/batch-get',
+                          json={'ids': client.rng.sample(client.shared['published'], 20)})
+
+
+# 图像url取自recipe详情(不计时) 没有封面时为默认图像 原图或srcset中的一个宽度
+def scenario_media(client):
+    recipe = client.request('GET', '/recipes/{}'.format(client.rng.choice(client.shared['published']))).json()
+    url = urlsplit(client.rng.choice([recipe['cover_url']] + list(recipe['cover_srcset'].values())))
+    return client.request('GET', '{}?{}'.format(url.path, url.query) if url.query else url.path)
+
+
+def scenario_user(client):
+    return client.request('GET', '/users/user{}'.format(client.rng.randint(1, USERS)))
+
+
+def scenario_user_recipes(client):
+    return client.request('GET', '/users/user{}/recipes'.format(client.rng.randint(1, USERS)))
+
+
+def scenario_export(client):
+    return client.request('GET', '/users/user{}/recipes/export'.format(client.rng.randint(1, USERS)))
+
+
+def scenario_me(client):
+    return client.request('GET', '/me', headers=client.auth())
+
+
+def scenario_token(client):
+    return client.login()
+
+
+def scenario_refresh(client):
+    return client.request('POST', '/refresh', headers=client.auth(client.refresh_token))
+
+
+def scenario_create(client):
+    return client.create_recipe()
+
+
+def scenario_patch(client):
+    return client.request('PATCH', '/recipes/{}'.format(client.own_recipe()), headers=client.auth(),
+                          json={'description': phrase(client.rng, 6)})
+
+
+def scenario_publish(client):
+    return client.request('PUT', '/recipes/{}/publish'.format(client.own_recipe()), headers=client.auth())
+
+
+def scenario_unpublish(client):
+    return client.request('DELETE', '/recipes/{}/publish'.format(client.own_recipe()), headers=client.auth())
+
+
+def scenario_delete(client):
+    recipe_id = client.own_recipe()
+    client.recipes.remove(recipe_id)
+    return client.request('DELETE', '/recipes/{}'.format(recipe_id), headers=client.auth())
+
+
+def scenario_cover(client):
+    response = client.request('PUT', '/recipes/{}/cover'.format(client.own_recipe()), headers=client.auth(),
+                              files={'cover': ('cover.jpg', client.shared['jpeg'], 'image/jpeg')})
+    if response.status_code == 202:
+        client.jobs.append(response.json()['id'])
+    return response
+
+
+def scenario_avatar(client):
+    response = client.request('PUT', '/users/avatar', headers=client.auth(),
+                              files={'avatar': ('avatar.jpg', client.shared['jpeg'], 'image/jpeg')})
+    if response.status_code == 202:
+        client.jobs.append(response.json()['id'])
+    return response
+
+
+def scenario_image_job(client):
+    if not client.jobs:
+        scenario_cover(client)
+    if not client.jobs:
+        return None
+    return client.request('GET', '/images/jobs/{}'.format(client.rng.choice(client.jobs)), headers=client.auth())
+
+
+def scenario_bulk(client):
+    lines = [json.dumps({'name': phrase(client.rng, 3), 'ingredients': phrase(client.rng, 8),
+                         'cook_time': client.rng.randint(5, 120)}) for _ in range(50)]
+    return client.request('POST', '/recipes/bulk', headers=dict(client.auth(), **{'Content-Type': 'application/x-ndjson'}),
+                          data='\n'.join(lines).encode())
+
+
+def scenario_signup(client):
+    name = 'new{}x{}'.format(client.user_id, client.rng.getrandbits(48))
+    response = client.request('POST', '/users', json={'username': name, 'email': '{}@example.com'.format(name),
+                                                      'password': PASSWORD})
+    if response.status_code == 201:
+        with client.shared['lock']:
+            client.shared['signups'].append('{}@example.com'.format(name))
+    return response
+
+
+def scenario_activate(client):
+    with client.shared['lock']:
+        email = client.shared['signups'].pop() if client.shared['signups'] else None
+    if email is None:
+        scenario_signup(client)
+        with client.shared['lock']:
+            email = client.shared['signups'].pop() if client.shared['signups'] else None
+    if email is None:
+        return None
+    with client.shared['app'].app_context():
+        token = generate_token(email, salt='activate')
+    return client.request('GET', '/users/activate/{}'.format(token))
+
+
+def scenario_revoke(client):
+    client.login()
+    response = client.request('POST', '/revoke', headers=client.auth())
+    client.login()
+    return response
+
+
+SCENARIOS = [
+    ('GET /recipes?q=', '/recipes', 20, {200}, scenario_search),
+    ('GET /recipes', '/recipes', 10, {200}, scenario_list),
+    ('GET /recipes?cursor=', '/recipes', 5, {200}, scenario_list_cursor),
+    ('GET /recipes/<id>', '/recipes/<int:recipe_id>', 15, {200}, scenario_recipe),
+    ('POST /recipes/batch-get', '/recipes/batch-get', 3, {200}, scenario_batch_get),
+    ('GET /media/<path>', '/media/<path:filename>', 5, {200}, scenario_media),
+    ('GET /users/<username>', '/users/<string:username>', 5, {200}, scenario_user),
+    ('GET /users/<username>/recipes', '/users/<string:username>/recipes', 5, {200}, scenario_user_recipes),
+    ('GET /users/<username>/recipes/export', '/users/<string:username>/recipes/export', 1, {200}, scenario_export),
+    ('GET /me', '/me', 3, {200}, scenario_me),
+    ('POST /token', '/token', 2, {200}, scenario_token),
+    ('POST /refresh', '/refresh', 2, {200}, scenario_refresh),
+    ('POST /recipes', '/recipes', 5, {201}, scenario_create),
+    ('PATCH /recipes/<id>', '/recipes/<int:recipe_id>', 4, {200}, scenario_patch),
+    ('PUT /recipes/<id>/publish', '/recipes/<int:recipe_id>/publish', 4, {204}, scenario_publish),
+    ('DELETE /recipes/<id>/publish', '/recipes/<int:recipe_id>/publish', 2, {204}, scenario_unpublish),
+    ('DELETE /recipes/<id>', '/recipes/<int:recipe_id>', 1, {204}, scenario_delete),
+    ('PUT /recipes/<id>/cover', '/recipes/<int:recipe_id>/cover', 1, {200, 202}, scenario_cover),
+    ('PUT /users/avatar', '/users/avatar', 1, {200, 202}, scenario_avatar),
+    ('GET /images/jobs/<id>', '/images/jobs/<string:job_id>', 1, {200}, scenario_image_job),
+    ('POST /recipes/bulk', '/recipes/bulk', 1, {200}, scenario_bulk),
+    ('POST /users', '/users', 1, {201}, scenario_signup),
+    ('GET /users/activate/<token>', '/users/activate/<string:token>', 1, {204}, scenario_activate),
+    ('POST /revoke', '/revoke', 1, {200}, scenario_revoke),
+]
+
+
+# 不输出每个请求的访问日志
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(latency for latency, _ in values)
+        errors = sum(1 for _, ok in values if not ok)
+        endpoints[name] = {
+            'count': len(values),
+            'errors': errors,
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    total = sum(len(values) for values in samples.values())
+    all_latencies = sorted(latency for values in samples.values() for latency, _ in values)
+    return endpoints, {
+        'count': total,
+        'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+        'throughput_rps': round(total / elapsed, 2),
+        'p50_ms': round(percentile(all_latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(all_latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(all_latencies, 0.99) * 1000, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    app = create_app(make_config(args.database_uri))
+    with app.app_context():
+        db.create_all()
+        published = seed(rng)
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+    shared = {'app': app, 'published': published, 'jpeg': make_jpeg(rng), 'signups': [], 'lock': threading.Lock()}
+    clients = [Client(base_url, index % USERS + 1, random.Random(args.seed + index), shared)
+               for index in range(args.concurrency)]
+    for client in clients:
+        client.login()
+    weights = [weight for _, _, weight, _, _ in SCENARIOS]
+    samples = {}
+    samples_lock = threading.Lock()
+    remaining = iter(range(args.requests))
+
+    def worker(client):
+        while True:
+            with samples_lock:
+                if next(remaining, None) is None:
+                    return
+            name, _, _, expected, scenario = client.rng.choices(SCENARIOS, weights)[0]
+            response = scenario(client)
+            if response is None:
+                continue
+            with samples_lock:
+                samples.setdefault(name, []).append((response.duration, response.status_code in expected))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(client, )) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    image_queue.shutdown()
+    password_hasher.shutdown()
+
+    # 只检查register_resources注册的路由 不包括static和flask_uploads
+    rules = {rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != 'static' and '.' not in rule.endpoint}
+    endpoints, total = summarize(samples, elapsed)
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'elapsed_s': round(elapsed, 3),
+        },
+        'total': total,
+        'endpoints': endpoints,
+        'uncovered_routes': sorted(rules - {rule for _, rule, _, _, _ in SCENARIOS}),
+    }
+
+
+# 返回发生退化的路由
+def compare(baseline, results, threshold):
+    regressions = []
+    print('\n{:<40}{:>14}{:>14}{:>10}{:>14}{:>14}{:>10}'.format('endpoint', 'base p95', 'p95', 'change',
+                                                              'base rps', 'rps', 'change'))
+    for name, current in results['endpoints'].items():
+        base = baseline['endpoints'].get(name)
+        if base is None or min(base['count'], current['count']) < MIN_COMPARE_SAMPLES:
+            continue
+        p95_change = current['p95_ms'] / base['p95_ms'] - 1 if base['p95_ms'] else 0
+        rps_change = current['throughput_rps'] / base['throughput_rps'] - 1 if base['throughput_rps'] else 0
+        regressed = p95_change > threshold or rps_change < -threshold
+        if regressed:
+            regressions.append(name)
+        print('{:<40}{:>14.2f}{:>14.2f}{:>+9.0%}{:>14.2f}{:>14.2f}{:>+9.0%}{}'.format(
+            name, base['p95_ms'], current['p95_ms'], p95_change, base['throughput_rps'],
+            current['throughput_rps'], rps_change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end HTTP load benchmark')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database-uri', default=os.environ.get('BENCH_DATABASE_URI'))
+    parser.add_argument('--output', default='load_benchmark.json')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args)
+    print('{:<40}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('endpoint', 'count', 'errors', 'rps', 'p50 ms',
+                                                          'p95 ms', 'p99 ms'))
+    for name, endpoint in list(results['endpoints'].items()) + [('TOTAL', results['total'])]:
+        print('{:<40}{:>8}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            name, endpoint['count'], endpoint['errors'], endpoint['throughput_rps'], endpoint['p50_ms'],
+            endpoint['p95_ms'], endpoint['p99_ms']))
+    if results['uncovered_routes']:
+        print('routes without a scenario: {}'.format(', '.join(results['uncovered_routes'])))
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print('results saved to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.threshold)
+        if regressions:
+            print('{} endpoint(s) regressed by more than {:.0%}'.format(len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
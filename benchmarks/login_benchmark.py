@@ -0,0 +1,96 @@
+"""对比请求中直接散列与进程池散列时 POST /token 的吞吐量
+
+python -m benchmarks.login_benchmark [登录次数] [并发数]
+
+登录的同时由另一个客户端不断请求 GET /users/bench，统计其延迟，用于观察散列是否阻塞其他请求
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from app import create_app
+from config import Config
+from extensions import db, password_hasher
+from models.user import User
+from utils import hash_password
+
+
+def make_config(workers):
+    class BenchmarkConfig(Config):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'login_benchmark.db'))
+        RESPONSE_CACHE_BACKEND = None
+        MAIL_OUTBOX_ENABLED = False
+        PASSWORD_HASH_WORKERS = workers
+        # 所有请求来自同一IP 不限流
+        ADMISSION_ENABLED = False
+    return BenchmarkConfig
+
+
+def run(workers, total, concurrency):
+    app = create_app(make_config(workers))
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password=hash_password('password'),
+                    is_active=True)
+        db.session.add(user)
+        db.session.commit()
+        rounds = password_hasher.rounds
+
+    counter = iter(range(total))
+    lock = threading.Lock()
+    done = threading.Event()
+    latencies = []
+
+    def login():
+        client = app.test_client()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            response = client.post('/token', json={'email': 'bench@example.com', 'password': 'password'})
+            assert response.status_code == 200, response.json
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            start = time.perf_counter()
+            client.get('/users/bench')
+            latencies.append(time.perf_counter() - start)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=login) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+    password_hasher.shutdown()
+    return rounds, total / elapsed, latencies
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    print('{} logins, {} concurrent clients'.format(total, concurrency))
+    print('{:<20}{:>10}{:>14}{:>18}{:>18}'.format('mode', 'rounds', 'logins/sec', 'probe p50 ms', 'probe p95 ms'))
+    workers = os.cpu_count() or 2
+    for name, count in (('inline', 0), ('pool ({} workers)'.format(workers), workers)):
+        rounds, rate, latencies = run(count, total, concurrency)
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        print('{:<20}{:>10}{:>14.1f}{:>18.1f}{:>18.1f}'.format(name, rounds, rate,
+                                                              statistics.median(latencies or [0]) * 1000,
+                                                              p95 * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""检查单次图像上传的峰值内存(RSS)是否超出预算
+
+python -m benchmarks.memory_benchmark [预算MB]
+
+每张图像在独立的子进程中通过 PUT /recipes/<id>/cover 上传(请求中直接压缩)，
+上传前通过 /proc/self/clear_refs 重置峰值 上传后读取 VmHWM，超出预算时退出码为1。仅支持Linux。
+"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+from PIL import Image
+
+# 40MP JPEG、12MP JPEG 和 4MP PNG
+IMAGES = [('jpeg-40mp.jpg', (7300, 5480), 'JPEG'),
+          ('jpeg-12mp.jpg', (4000, 3000), 'JPEG'),
+          ('png-4mp.png', (2300, 1730), 'PNG')]
+
+
+def make_image(path, size, fmt):
+    channels = [Image.effect_noise((size[0] // 16, size[1] // 16), 60 + 30 * k) for k in range(3)]
+    image = Image.merge('RGB', channels).resize(size, Image.Resampling.BICUBIC)
+    image.save(path, fmt, quality=80) if fmt == 'JPEG' else image.save(path, fmt)
+
+
+def peak_rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+
+
+def current_rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+
+# 子进程: 上传一张图像并输出峰值内存的增长(KB)
+def child(path):
+    from flask_jwt_extended import create_access_token
+    from werkzeug.test import EnvironBuilder
+
+    from app import create_app
+    from config import Config
+    from extensions import db
+    from models.recipe import Recipe
+    from models.user import User
+
+    class BenchmarkConfig(Config):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'memory_benchmark.db'))
+        UPLOADED_IMAGES_DEST = tempfile.mkdtemp()
+        IMAGE_PROCESSING_WORKERS = 0
+        RESPONSE_CACHE_BACKEND = None
+
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='x', is_active=True)
+        db.session.add(user)
+        db.session.commit()
+        recipe = Recipe(name='bench', user_id=user.id)
+        recipe.save()
+        with app.test_request_context():
+            token = create_access_token(identity=user.id, fresh=True)
+        recipe_id = recipe.id
+
+    with open(path, 'rb') as upload:
+        body = upload.read()
+    builder = EnvironBuilder(path='/recipes/{}/cover'.format(recipe_id), method='PUT',
+                             headers={'Authorization': 'Bearer {}'.format(token)},
+                             data={'cover': (io.BytesIO(body), os.path.basename(path))})
+    environ = builder.get_environ()
+    client = app.test_client()
+    # 重置峰值 只统计处理请求期间的增长
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+    baseline = current_rss_kb()
+    response = client.open(environ)
+    assert response.status_code == 200, response.json
+    print(peak_rss_kb() - baseline)
+
+
+def main():
+    budget_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workdir = tempfile.mkdtemp()
+    failed = False
+    print('{:<16}{:>12}{:>18}'.format('image', 'size MB', 'peak delta MB'))
+    for name, size, fmt in IMAGES:
+        path = os.path.join(workdir, name)
+        make_image(path, size, fmt)
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.memory_benchmark', '--child', path],
+                                check=True, capture_output=True, text=True).stdout
+        peak_mb = int(output.strip().splitlines()[-1]) / 1024
+        failed = failed or peak_mb > budget_mb
+        print('{:<16}{:>12.1f}{:>18.1f}{}'.format(name, os.path.getsize(path) / 1024 / 1024, peak_mb,
+                                                  '  OVER BUDGET' if peak_mb > budget_mb else ''))
+    print('budget {:.0f} MB per upload: {}'.format(budget_mb, 'FAIL' if failed else 'OK'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,115 @@
+"""检查recipe列表查询的执行计划 有查询对recipe表全表扫描时退出码为1
+
+python -m benchmarks.query_plan_check [数据库URI]
+
+默认使用临时SQLite数据库 也可以传入空的PostgreSQL测试库(会创建表并写入数据)
+覆盖 Recipe.get_all_published 的每种排序(分页和游标分页) 以及 Recipe.get_all_by_user 的每种可见性
+"""
+import os
+import random
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app
+from config import Config
+from extensions import db
+from models.recipe import Recipe
+from models.user import User
+
+USERS = 200
+RECIPES = 20000
+# SQLite: "SCAN recipe" 后没有 USING INDEX 即为全表扫描
+SEQ_SCAN = {
+    'sqlite': re.compile(r'\bSCAN recipe\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on recipe\b'),
+}
+
+
+def seed():
+    rng = random.Random(1)
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'is_active': True}
+        for i in range(1, USERS + 1)])
+    start = datetime(2020, 1, 1)
+    db.session.execute(Recipe.__table__.insert(), [
+        {'name': 'recipe {}'.format(i), 'user_id': rng.randint(1, USERS), 'is_publish': rng.random() < 0.6,
+         'cook_time': rng.choice([None, rng.randint(1, 300)]), 'num_of_servings': rng.choice([None, rng.randint(1, 50)]),
+         'created_at': start + timedelta(minutes=i), 'updated_at': start + timedelta(minutes=i)}
+        for i in range(RECIPES)])
+    db.session.commit()
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM ANALYZE recipe')
+    else:
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+
+def listing_queries():
+    for sort in ['created_at', 'cook_time', 'num_of_servings']:
+        for order in ['asc', 'desc']:
+            yield 'published sort={} order={}'.format(sort, order), \
+                lambda: Recipe.get_all_published('', 3, 20, sort, order)
+            yield 'published sort={} order={} cursor'.format(sort, order), \
+                lambda: next_page(Recipe.get_all_published('', 1, 20, sort, order, cursor=''),
+                                  lambda cursor: Recipe.get_all_published('', 1, 20, sort, order, cursor=cursor))
+    for visibility in ['public', 'private', 'all']:
+        yield 'user visibility={}'.format(visibility), \
+            lambda: Recipe.get_all_by_user(7, 2, 10, visibility=visibility)
+        yield 'user visibility={} cursor'.format(visibility), \
+            lambda: next_page(Recipe.get_all_by_user(7, 1, 10, visibility=visibility, cursor=''),
+                              lambda cursor: Recipe.get_all_by_user(7, 1, 10, visibility=visibility, cursor=cursor))
+
+
+def next_page(paginated, fetch):
+    return fetch(paginated.next_cursor)
+
+
+def explain(statement, parameters):
+    if db.engine.dialect.name == 'postgresql':
+        sql = 'EXPLAIN ' + statement
+        column = 0
+    else:
+        sql = 'EXPLAIN QUERY PLAN ' + statement
+        column = 3
+    with db.engine.connect() as connection:
+        return [row[column] for row in connection.exec_driver_sql(sql, parameters)]
+
+
+def main():
+    uri = sys.argv[1] if len(sys.argv) > 1 else \
+        'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'query_plan_check.db'))
+    config = type('CheckConfig', (Config, ), {'DEBUG': False, 'SQLALCHEMY_DATABASE_URI': uri,
+                                              'RESPONSE_CACHE_BACKEND': None, 'MAIL_OUTBOX_ENABLED': False})
+    app = create_app(config)
+    failed = False
+    with app.test_request_context():
+        db.create_all()
+        seed()
+        pattern = SEQ_SCAN[db.engine.dialect.name]
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, parameters, context, executemany:
+                     statements.append((statement, parameters)))
+        for name, run in listing_queries():
+            del statements[:]
+            run()
+            db.session.remove()
+            plans = [(statement, explain(statement, parameters)) for statement, parameters in list(statements)
+                     if 'recipe' in statement]
+            scans = [(statement, plan) for statement, plan in plans if any(pattern.search(line) for line in plan)]
+            failed = failed or bool(scans)
+            print('{:<45} {} queries  {}'.format(name, len(plans), 'SEQ SCAN' if scans else 'ok'))
+            for statement, plan in scans:
+                print('    {}\n    {}'.format(' '.join(statement.split()), '\n    '.join(plan)))
+        db.drop_all()
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
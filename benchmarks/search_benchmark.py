@@ -0,0 +1,88 @@
+"""对比 ilike '%q%' 与全文检索在大数据量下 GET /recipes 的查询耗时
+
+python -m benchmarks.search_benchmark [recipe数量]
+
+默认使用临时SQLite文件(FTS5)，设置 BENCH_DATABASE_URI 可在PostgreSQL(GIN)上运行
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from app import create_app
+from config import Config
+from extensions import db
+from models.recipe import Recipe
+from models.user import User
+from search import ilike_search, recipe_search
+
+WORDS = ['rice', 'curry', 'soup', 'paella', 'tomato', 'onion', 'garlic', 'coconut', 'bean', 'chicken',
+         'beef', 'noodle', 'salad', 'lemon', 'ginger', 'pepper', 'cheese', 'bread', 'potato', 'mushroom',
+         'spinach', 'tofu', 'basil', 'honey', 'butter', 'carrot', 'pumpkin', 'apple', 'vanilla', 'chili']
+KEYWORDS = ['curry', 'coconut rice', 'mushroom soup', 'vanilla', 'basil tomato']
+REPEAT = 20
+PER_PAGE = 20
+
+
+class BenchmarkConfig(Config):
+    DEBUG = False
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URI') or \
+        'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'search_benchmark.db'))
+
+
+def phrase(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def seed(total):
+    rng = random.Random(42)
+    user = User(username='bench', email='bench@example.com', password='x', is_active=True)
+    db.session.add(user)
+    db.session.flush()
+    table = Recipe.__table__
+    for start in range(0, total, 5000):
+        rows = [{'name': phrase(rng, 3).title(),
+                 'description': 'This is a lovely {}'.format(phrase(rng, 6)),
+                 'ingredients': phrase(rng, 12),
+                 'directions': 'This is how you make it',
+                 'num_of_servings': rng.randint(1, 10),
+                 'cook_time': rng.randint(5, 300),
+                 'is_publish': rng.random() < 0.8,
+                 'user_id': user.id} for _ in range(start, min(start + 5000, total))]
+        db.session.execute(table.insert(), rows)
+    recipe_search().rebuild()
+    db.session.commit()
+
+
+def run(backend, q):
+    query, rank_logic = backend.match(Recipe, Recipe.query.filter(Recipe.is_publish.is_(True)), q)
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        query.order_by(rank_logic, Recipe.id.desc()).paginate(page=1, per_page=PER_PAGE)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        seed(total)
+        print('seeded {} recipes on {} in {:.1f}s'.format(total, db.engine.dialect.name, time.perf_counter() - start))
+        print('{:<16}{:>14}{:>14}{:>10}'.format('keyword', 'ilike p50 ms', 'fts p50 ms', 'speedup'))
+        for q in KEYWORDS:
+            ilike_ms = run(ilike_search, q)
+            fts_ms = run(recipe_search(), q)
+            print('{:<16}{:>14.2f}{:>14.2f}{:>9.1f}x'.format(q, ilike_ms, fts_ms, ilike_ms / fts_ms))
+        db.session.remove()
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
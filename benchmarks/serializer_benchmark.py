@@ -0,0 +1,127 @@
+"""检查编译后的RecipeSchema/UserSchema与marshmallow原来的dump()输出是否完全相同 并对比速度
+
+python -m benchmarks.serializer_benchmark [recipe数量]
+
+输出不一致时退出码为1
+"""
+import json
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from app import create_app
+from config import Config
+from models.recipe import Recipe
+from models.user import User
+from schemas.compiled import CompiledSchema
+from schemas.recipe import RecipeSchema, RecipePaginationSchema, RecipeCursorPaginationSchema
+from schemas.user import UserSchema
+
+SCHEMAS = {
+    'RecipeSchema()': RecipeSchema(),
+    'RecipeSchema(many=True)': RecipeSchema(many=True),
+    "RecipeSchema(only=('cover_url', ))": RecipeSchema(only=('cover_url', )),
+    "RecipeSchema(exclude=('author', ))": RecipeSchema(exclude=('author', )),
+    'UserSchema()': UserSchema(),
+    "UserSchema(exclude=('email', ))": UserSchema(exclude=('email', )),
+    "UserSchema(only=('avatar_url', ))": UserSchema(only=('avatar_url', )),
+}
+
+
+class Page:
+    def __init__(self, items):
+        self.items = items
+        self.page, self.pages, self.per_page, self.total = 2, 5, len(items), 5 * len(items)
+        self.has_prev = self.has_next = True
+        self.prev_num, self.next_num = 1, 3
+        self.prev_cursor, self.next_cursor = 'prev', 'next'
+
+
+# 关闭编译 得到marshmallow原来的输出
+@contextmanager
+def marshmallow_dump():
+    compiled = CompiledSchema._get_compiled
+    CompiledSchema._get_compiled = lambda self: None
+    try:
+        yield
+    finally:
+        CompiledSchema._get_compiled = compiled
+
+
+def random_datetime(rng):
+    value = datetime(2020, 1, 1) + timedelta(seconds=rng.randrange(10 ** 8))
+    return value.replace(microsecond=rng.choice([0, rng.randrange(10 ** 6)]))
+
+
+def make_recipes(count, seed=1):
+    rng = random.Random(seed)
+    maybe = lambda value: rng.choice([value, None])
+    users = [User(id=i, username='user{}'.format(i), email='user{}@example.com'.format(i),
+                  avatar_image=maybe('avatar{}.jpg'.format(i)), created_at=random_datetime(rng),
+                  updated_at=maybe(random_datetime(rng))) for i in range(1, 20)]
+    recipes = []
+    for i in range(count):
+        recipe = Recipe(id=i + 1, name='Recipe {} "ü" \\ </script>'.format(i),
+                        description=maybe('description {}'.format(i)), ingredients=maybe('rice, 椰子'),
+                        directions=maybe('cook\nserve'), num_of_servings=maybe(rng.randrange(1, 50)),
+                        cook_time=maybe(rng.randrange(1, 300)), is_publish=rng.choice([True, False, None]),
+                        cover_image=maybe('cover{}.jpg'.format(i)), created_at=random_datetime(rng),
+                        updated_at=maybe(random_datetime(rng)))
+        recipe.user = maybe(rng.choice(users))
+        recipes.append(recipe)
+    return users, recipes
+
+
+def dumps(schema, obj):
+    return json.dumps(schema.dump(obj))
+
+
+def check_parity(users, recipes):
+    cases = []
+    for name, schema in SCHEMAS.items():
+        objects = users if name.startswith('User') else recipes
+        cases += [(name, schema, objects if schema.many else obj) for obj in objects[:200]]
+    cases.append(('RecipePaginationSchema()', RecipePaginationSchema(), Page(recipes[:20])))
+    cases.append(('RecipeCursorPaginationSchema()', RecipeCursorPaginationSchema(), Page(recipes[:20])))
+    compiled = [dumps(schema, obj) for _, schema, obj in cases]
+    with marshmallow_dump():
+        expected = [dumps(schema, obj) for _, schema, obj in cases]
+    mismatches = [(name, want, got) for (name, _, _), want, got in zip(cases, expected, compiled) if want != got]
+    for name, want, got in mismatches[:5]:
+        print('MISMATCH {}\n  marshmallow: {}\n  compiled:    {}'.format(name, want, got))
+    print('parity: {} cases, {} mismatches'.format(len(cases), len(mismatches)))
+    return not mismatches
+
+
+def timeit(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app = create_app(type('BenchmarkConfig', (Config, ), {'DEBUG': False,
+                                                          'SQLALCHEMY_DATABASE_URI': 'sqlite://'}))
+    with app.test_request_context('/recipes?page=2'):
+        users, recipes = make_recipes(count)
+        ok = check_parity(users, recipes)
+        # 第二行不含图像url(cover_url、cover_srcset和author的avatar_url) 只有属性字段
+        url_fields = ('cover_url', 'cover_srcset', 'author')
+        for name, schema in (('RecipeSchema(many=True)', RecipeSchema(many=True)),
+                             ('exclude={!r}'.format(url_fields), RecipeSchema(many=True, exclude=url_fields))):
+            fast = timeit(lambda: schema.dump(recipes))
+            with marshmallow_dump():
+                slow = timeit(lambda: schema.dump(recipes))
+            print('{:<52} x {}: marshmallow {:.1f} ms, compiled {:.1f} ms, {:.1f}x'.format(
+                name, count, slow * 1000, fast * 1000, slow / fast))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
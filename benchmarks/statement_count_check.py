@@ -0,0 +1,98 @@
+"""检查recipe列表每个请求执行的SQL语句数 与per_page无关 不一致时退出码为1
+
+python -m benchmarks.statement_count_check [数据库URI]
+
+默认使用临时SQLite数据库 也可以传入空的PostgreSQL测试库(会创建表并写入数据)
+通过test_client请求 /recipes(分页和游标分页) 以及 /users/<username>/recipes(分页和游标分页)
+每页的作者一次IN查询加载(见loaders.py) 语句数应为:
+  分页: 3 (count、当前页、作者)  游标分页: 2 (当前页、作者)  用户的recipe列表: 2 (用户、当前页)
+关闭了响应缓存和准入控制 每个请求都访问数据库
+"""
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import create_app
+from config import Config
+from extensions import db
+from models.recipe import Recipe
+from models.user import User
+
+# user1 约有四分之一的recipe 用户的recipe列表每种per_page都有第二页
+USERS = 50
+RECIPES = 2000
+PER_PAGE = [1, 5, 20, 50]
+EXPECTED = {'paged': 3, 'cursor': 2, 'user': 2}
+
+
+def seed():
+    rng = random.Random(1)
+    db.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i), 'is_active': True}
+        for i in range(1, USERS + 1)])
+    start = datetime(2020, 1, 1)
+    db.session.execute(Recipe.__table__.insert(), [
+        {'name': 'recipe {}'.format(i), 'user_id': 1 if i % 5 == 0 else rng.randint(1, USERS),
+         'is_publish': rng.random() < 0.6,
+         'cook_time': rng.randint(1, 300), 'num_of_servings': rng.randint(1, 50),
+         'created_at': start + timedelta(minutes=i), 'updated_at': start + timedelta(minutes=i)}
+        for i in range(RECIPES)])
+    db.session.commit()
+    Recipe.repair_user_counts()
+
+
+def requests(client):
+    for per_page in PER_PAGE:
+        yield 'paged', '/recipes?per_page={}&page=2'.format(per_page)
+        for sort in ['created_at', 'cook_time']:
+            yield 'paged', '/recipes?per_page={}&sort={}'.format(per_page, sort)
+            first = '/recipes?cursor=&per_page={}&sort={}'.format(per_page, sort)
+            yield 'cursor', first
+            yield 'cursor', client.get(first).json['links']['next']
+        yield 'user', '/users/user1/recipes?per_page={}'.format(per_page)
+        yield 'user', '/users/user1/recipes?per_page={}&page=2'.format(per_page)
+        first = '/users/user1/recipes?cursor=&per_page={}'.format(per_page)
+        yield 'user', first
+        yield 'user', client.get(first).json['links']['next']
+
+
+def main():
+    uri = sys.argv[1] if len(sys.argv) > 1 else \
+        'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'statement_count_check.db'))
+    config = type('CheckConfig', (Config, ), {'DEBUG': False, 'SQLALCHEMY_DATABASE_URI': uri,
+                                              'RESPONSE_CACHE_BACKEND': None, 'ADMISSION_ENABLED': False,
+                                              'MAIL_OUTBOX_ENABLED': False})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        seed()
+        engine = db.engine
+    statements = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, parameters, context, executemany: statements.append(statement))
+    # 每个请求单独的应用上下文 作者缓存(flask.g)和session不跨请求
+    client = app.test_client()
+    failed = False
+    for kind, url in requests(client):
+        del statements[:]
+        response = client.get(url)
+        count = len(statements)
+        ok = response.status_code == 200 and count == EXPECTED[kind]
+        failed = failed or not ok
+        print('{:<60} {} {} statements  {}'.format(url[:60], response.status_code, count,
+                                                    'ok' if ok else 'expected {}'.format(EXPECTED[kind])))
+        if not ok:
+            for statement in statements:
+                print('    {}'.format(' '.join(statement.split())))
+    with app.app_context():
+        db.drop_all()
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""对比请求中直接压缩与进程池后台压缩时 PUT /recipes/<id>/cover 的吞吐量
+
+python -m benchmarks.upload_benchmark [上传数量] [并发数]
+
+图像尺寸混合 640x480 / 1920x1080 / 4000x3000，后台模式同时统计全部处理完成所需的时间
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from config import Config
+from extensions import db, image_queue
+from models.image_job import ImageJob
+from models.recipe import Recipe
+from models.user import User
+
+SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+
+
+def make_config(workers, total):
+    class BenchmarkConfig(Config):
+        DEBUG = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(os.path.join(tempfile.mkdtemp(), 'upload_benchmark.db'))
+        UPLOADED_IMAGES_DEST = tempfile.mkdtemp()
+        IMAGE_PROCESSING_WORKERS = workers
+        IMAGE_PROCESSING_QUEUE_SIZE = total
+        RESPONSE_CACHE_BACKEND = None
+        # 所有请求来自同一IP 不限流
+        ADMISSION_ENABLED = False
+    return BenchmarkConfig
+
+
+# 由低分辨率噪点放大得到的图像 编码开销与照片接近 且不超过10MB的上传限制
+def make_images():
+    images = []
+    for width, height in SIZES:
+        channels = [Image.effect_noise((width // 8, height // 8), 80 + 20 * k) for k in range(3)]
+        image = Image.merge('RGB', channels).resize((width, height), Image.Resampling.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def run(workers, total, concurrency, images):
+    app = create_app(make_config(workers, total))
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com', password='x', is_active=True)
+        db.session.add(user)
+        db.session.commit()
+        recipe = Recipe(name='bench', user_id=user.id, is_publish=True)
+        recipe.save()
+        recipe_id = recipe.id
+        with app.test_request_context():
+            headers = {'Authorization': 'Bearer {}'.format(create_access_token(identity=user.id, fresh=True))}
+
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            data = {'cover': (io.BytesIO(images[index % len(images)]), 'cover.jpg')}
+            response = client.put('/recipes/{}/cover'.format(recipe_id), data=data, headers=headers,
+                                  content_type='multipart/form-data')
+            assert response.status_code in (200, 202), response.json
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - start
+    # 等待后台任务全部完成
+    with app.app_context():
+        while ImageJob.query.filter_by(status='pending').count():
+            db.session.remove()
+            time.sleep(0.05)
+    finished = time.perf_counter() - start
+    image_queue.shutdown()
+    return accepted, finished
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    images = make_images()
+    print('{} uploads, {} concurrent clients, sizes {}'.format(total, concurrency, SIZES))
+    print('{:<22}{:>16}{:>20}'.format('mode', 'requests/sec', 'processed/sec'))
+    accepted, finished = run(0, total, concurrency, images)
+    print('{:<22}{:>16.1f}{:>20.1f}'.format('inline', total / accepted, total / finished))
+    workers = os.cpu_count() or 2
+    accepted, finished = run(workers, total, concurrency, images)
+    print('{:<22}{:>16.1f}{:>20.1f}'.format('pool ({} workers)'.format(workers), total / accepted, total / finished))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+
+# Bloom过滤器 每个位置占一个字节
+# 多个进程同时写入时只有"置1"操作 不会因读-改-写丢失其他进程写入的位
+class BloomFilter:
+    def __init__(self, slots, num_hashes=7):
+        self.slots = slots
+        self.size = len(slots)
+        self.num_hashes = num_hashes
+
+    # 通过mmap在多个进程间共享
+    @classmethod
+    def from_file(cls, path, size, num_hashes=7):
+        with open(path, 'a+b') as file:
+            if os.path.getsize(path) != size:
+                file.truncate(size)
+            slots = mmap.mmap(file.fileno(), size)
+        return cls(slots, num_hashes)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.slots[position] = 1
+
+    def __contains__(self, key):
+        return all(self.slots[position] for position in self._positions(key))
+
+    # 用当前有效的key重建 清除已过期key留下的位
+    def reset(self, keys):
+        slots = bytearray(self.size)
+        for key in keys:
+            for position in self._positions(key):
+                slots[position] = 1
+        self.slots[:] = slots
+
+
+# 单进程使用
+class MemoryBlocklistStore:
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def add(self, jti, expires_at):
+        with self._lock:
+            self._tokens[jti] = expires_at
+
+    def contains(self, jti, now):
+        return self._tokens.get(jti, 0) > now
+
+    def purge(self, now):
+        with self._lock:
+            self._tokens = {jti: expires_at for jti, expires_at in self._tokens.items() if expires_at > now}
+            return list(self._tokens), lambda: []
+
+
+# 多个worker进程共享的SQLite(WAL)文件
+class SqliteBlocklistStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS revoked_token '
+                                   '(jti TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def add(self, jti, expires_at):
+        self._connection().execute('INSERT OR REPLACE INTO revoked_token (jti, expires_at) VALUES (?, ?)',
+                                   (jti, expires_at))
+
+    def contains(self, jti, now):
+        return self._connection().execute('SELECT 1 FROM revoked_token WHERE jti = ? AND expires_at > ?',
+                                          (jti, now)).fetchone() is not None
+
+    # 删除已过期的token 返回仍有效的jti 以及在此期间新加入的jti
+    def purge(self, now):
+        connection = self._connection()
+        connection.execute('DELETE FROM revoked_token WHERE expires_at <= ?', (now,))
+        rows = connection.execute('SELECT rowid, jti FROM revoked_token').fetchall()
+        last_rowid = max((rowid for rowid, _ in rows), default=0)
+
+        def added_since():
+            return [jti for jti, in connection.execute('SELECT jti FROM revoked_token WHERE rowid > ?',
+                                                        (last_rowid,))]
+        return [jti for _, jti in rows], added_since
+
+
+# 已注销token的黑名单
+# token到期(exp)后自动失效并定期清理
+# 前面的Bloom过滤器判断不在黑名单中时 不查询存储
+class TokenBlocklist:
+    def __init__(self, app=None):
+        self.store = None
+        self.bloom = None
+        self.purge_interval = 600
+        self._last_purge = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JWT_BLOCKLIST_BACKEND', 'sqlite')
+        app.config.setdefault('JWT_BLOCKLIST_PATH', '/tmp/smilecook-blocklist.db')
+        app.config.setdefault('JWT_BLOCKLIST_BLOOM_SIZE', 1024 * 1024)
+        app.config.setdefault('JWT_BLOCKLIST_PURGE_INTERVAL', 600)
+        size = app.config['JWT_BLOCKLIST_BLOOM_SIZE']
+        if app.config['JWT_BLOCKLIST_BACKEND'] == 'sqlite':
+            path = app.config['JWT_BLOCKLIST_PATH']
+            self.store = SqliteBlocklistStore(path)
+            self.bloom = BloomFilter.from_file('{}.bloom'.format(path), size)
+        else:
+            self.store = MemoryBlocklistStore()
+            self.bloom = BloomFilter(bytearray(size))
+        self.purge_interval = app.config['JWT_BLOCKLIST_PURGE_INTERVAL']
+        app.extensions['token_blocklist'] = self
+
+    # 先写入存储再写入Bloom过滤器 其他进程看到Bloom中的位时一定能查到记录
+    def add(self, jti, expires_at):
+        self.store.add(jti, expires_at)
+        self.bloom.add(jti)
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self.purge()
+
+    def is_revoked(self, jti):
+        if jti not in self.bloom:
+            return False
+        return self.store.contains(jti, time.time())
+
+    def purge(self):
+        self._last_purge = time.monotonic()
+        live, added_since = self.store.purge(time.time())
+        self.bloom.reset(live)
+        # 重建期间其他进程新加入的token
+        for jti in added_since():
+            self.bloom.add(jti)
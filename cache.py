@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import json
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.util import await_only
+
+
+# 进程内缓存 LRU + TTL
+# 版本号单独存放 不参与淘汰
+class MemoryCacheBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.setdefault(key, initial_version())
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, initial_version()) + 1
+            return self._counters[key]
+
+
+# 多个worker进程共享的本地缓存 通过unix socket(或host:port)连接memcached
+# memcached -s /tmp/smilecook-cache.sock
+# 连接失败时视为未命中 不影响请求
+class SocketCacheBackend:
+    def __init__(self, address, timeout=0.5):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        if ':' in self.address:
+            host, port = self.address.rsplit(':', 1)
+            sock = socket.create_connection((host, int(port)), timeout=self.timeout)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+        self._local.sock = sock
+        self._local.file = sock.makefile('rb')
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _command(self, line, data=None):
+        try:
+            if getattr(self._local, 'sock', None) is None:
+                self._connect()
+            payload = line.encode() + b'\r\n'
+            if data is not None:
+                payload += data + b'\r\n'
+            self._local.sock.sendall(payload)
+            return self._local.file
+        except OSError:
+            self._close()
+            return None
+
+    def _readline(self, file):
+        try:
+            return file.readline().rstrip(b'\r\n')
+        except OSError:
+            self._close()
+            return None
+
+    # memcached的key不能超过250字节且不能含空白
+    @staticmethod
+    def _key(key):
+        return 'smilecook:' + hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key):
+        file = self._command('get {}'.format(self._key(key)))
+        if file is None:
+            return None
+        header = self._readline(file)
+        if not header or not header.startswith(b'VALUE'):
+            return None
+        try:
+            data = file.read(int(header.split()[3]) + 2)[:-2]
+            file.readline()
+        except (OSError, ValueError, IndexError):
+            self._close()
+            return None
+        return json.loads(data)
+
+    def set(self, key, value, ttl):
+        data = json.dumps(value).encode()
+        file = self._command('set {} 0 {} {}'.format(self._key(key), int(ttl), len(data)), data)
+        if file is not None:
+            self._readline(file)
+
+    def get_counter(self, key):
+        file = self._command('get {}'.format(self._key(key)))
+        header = file and self._readline(file)
+        if header and header.startswith(b'VALUE'):
+            value = self._readline(file)
+            self._readline(file)
+            return int(value)
+        # 版本号被淘汰或尚未创建时 使用时间戳作为初始值 避免与旧版本重复
+        version = initial_version()
+        data = str(version).encode()
+        file = self._command('add {} 0 0 {}'.format(self._key(key), len(data)), data)
+        if file is not None and self._readline(file) == b'NOT_STORED':
+            return self.get_counter(key)
+        return version
+
+    def incr(self, key):
+        file = self._command('incr {} 1'.format(self._key(key)))
+        line = file and self._readline(file)
+        if line and line.isdigit():
+            return int(line)
+        return self.get_counter(key)
+
+
+def initial_version():
+    return int(time.time() * 1000)
+
+
+# 是否在事件循环的线程中(ASGI模式 见asgi.py) 此时阻塞等待其他请求会使整个事件循环停止
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+# 在AsyncSession.run_sync()的greenlet中等待predicate()为True 切换回事件循环轮询 超时返回False
+def wait_in_event_loop(predicate, timeout=None, interval=0.005):
+    async def poll():
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not predicate():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+    return await_only(poll())
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# 合并并发的相同请求 同一个key同时只有一个线程计算 其他线程等待结果
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if in_event_loop():
+                wait_in_event_loop(call.event.is_set)
+            else:
+                call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+# 响应缓存 key中包含命名空间的版本号
+# 数据变化时调用bump()使该命名空间下的所有缓存失效
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 30
+        self.single_flight = SingleFlight()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_BACKEND', 'memory')
+        app.config.setdefault('RESPONSE_CACHE_SOCKET', '/tmp/smilecook-cache.sock')
+        app.config.setdefault('RESPONSE_CACHE_TTL', 30)
+        app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+        backend = app.config['RESPONSE_CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryCacheBackend(max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+        elif backend == 'socket':
+            self.backend = SocketCacheBackend(app.config['RESPONSE_CACHE_SOCKET'])
+        else:
+            self.backend = None
+        self.ttl = app.config['RESPONSE_CACHE_TTL']
+        app.extensions['response_cache'] = self
+
+    def bump(self, namespace):
+        if self.backend is not None:
+            self.backend.incr('{}:version'.format(namespace))
+
+    # compute返回None时不缓存
+    # on_miss在未命中时由每个请求各自调用 在合并(SingleFlight)之前 可以抛出异常拒绝本请求
+    def get_or_set(self, namespace, key, compute, on_miss=None):
+        if self.backend is None:
+            if on_miss is not None:
+                on_miss()
+            return compute()
+        version = self.backend.get_counter('{}:version'.format(namespace))
+        cache_key = '{}:{}:{}'.format(namespace, version, key)
+        value = self.backend.get(cache_key)
+        if value is not None:
+            return value
+        if on_miss is not None:
+            on_miss()
+
+        def fill():
+            # 等待期间可能已被其他请求写入
+            cached = self.backend.get(cache_key)
+            if cached is not None:
+                return cached
+            result = compute()
+            if result is not None:
+                self.backend.set(cache_key, result, self.ttl)
+            return result
+
+        return self.single_flight.do(cache_key, fill)
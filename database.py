@@ -0,0 +1,186 @@
+import random
+from functools import wraps
+
+from flask import current_app
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from cache import MemoryCacheBackend, SocketCacheBackend
+
+
+# 设置了session.info['replica']时 查询发送到该只读副本
+# flush以及本次session已写入数据之后 始终使用主库
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('wrote'):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+# 连接池参数和只读副本
+# DATABASE_REPLICA_URIS中的每个副本注册为bind replica_0, replica_1, ...
+# 用户写入后DATABASE_REPLICA_STICKY_SECONDS秒内 该用户的读请求仍发送到主库(读到自己的写入)
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        self.sticky = None
+        self.sticky_seconds = 5
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_POOL_SIZE', 10)
+        app.config.setdefault('DATABASE_MAX_OVERFLOW', 20)
+        app.config.setdefault('DATABASE_POOL_TIMEOUT', 10)
+        app.config.setdefault('DATABASE_POOL_RECYCLE', 1800)
+        app.config.setdefault('DATABASE_POOL_PRE_PING', True)
+        app.config.setdefault('DATABASE_REPLICA_URIS', [])
+        app.config.setdefault('DATABASE_REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('DATABASE_REPLICA_STICKY_BACKEND', 'memory')
+        app.config.setdefault('DATABASE_REPLICA_STICKY_SOCKET', '/tmp/smilecook-cache.sock')
+        app.config.setdefault('ASYNC_DATABASE_URI', None)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        for index, uri in enumerate(app.config['DATABASE_REPLICA_URIS']):
+            binds['replica_{}'.format(index)] = uri
+        app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+
+        if app.config['DATABASE_REPLICA_STICKY_BACKEND'] == 'socket':
+            self.sticky = SocketCacheBackend(app.config['DATABASE_REPLICA_STICKY_SOCKET'])
+        else:
+            self.sticky = MemoryCacheBackend(max_entries=10000)
+        self.sticky_seconds = app.config['DATABASE_REPLICA_STICKY_SECONDS']
+        app.before_request(self._reset_replica)
+        app.after_request(self._remember_write)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    # SQLite使用Flask-SQLAlchemy默认的连接池
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if not sa_url.drivername.startswith('sqlite'):
+            options.setdefault('pool_size', app.config['DATABASE_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['DATABASE_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', app.config['DATABASE_POOL_TIMEOUT'])
+            options.setdefault('pool_recycle', app.config['DATABASE_POOL_RECYCLE'])
+            options.setdefault('pool_pre_ping', app.config['DATABASE_POOL_PRE_PING'])
+        return sa_url, options
+
+    # 随机选择一个副本 没有配置副本或当前用户刚写入过数据时返回None
+    def get_replica(self):
+        app = current_app._get_current_object()
+        replicas = app.config['DATABASE_REPLICA_URIS']
+        if not replicas:
+            return None
+        user_id = current_identity()
+        if user_id is not None and self.sticky.get('primary:{}'.format(user_id)):
+            return None
+        return self.get_engine(app, bind='replica_{}'.format(random.randrange(len(replicas))))
+
+    # 同一个app context中处理多个请求时(测试)session会被复用
+    def _reset_replica(self):
+        self.session.info.pop('replica', None)
+        self.session.info.pop('wrote', None)
+
+    def _remember_write(self, response):
+        if self.session.info.pop('wrote', False):
+            user_id = current_identity()
+            if user_id is not None:
+                self.sticky.set('primary:{}'.format(user_id), 1, self.sticky_seconds)
+        return response
+
+
+def current_identity():
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+# 只读的资源方法 本次请求的查询发送到只读副本(包括流式响应中的查询)
+# 需放在jwt_required之后(下方) 以便判断当前用户
+def use_replica(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        db = current_app.extensions['sqlalchemy'].db
+        replica = db.get_replica()
+        if replica is not None:
+            db.session.info['replica'] = replica
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+# 同步驱动对应的asyncio驱动
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_database_url(uri):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+# 与RoutingSession相同 session.info['replica']为同步引擎(db.get_replica()) 换成对应副本的asyncio引擎
+class AsyncRoutingSession(orm.Session):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('wrote'):
+            return self.info['replica_engines'][replica]
+        return super().get_bind(mapper, clause, **kwargs)
+
+
+# asyncio引擎 供ASGI模式使用(见asgi.py)
+# 原有的同步代码(Model.query、分页、schema)在AsyncSession.run_sync()中执行 这期间db.session即为该session
+# 执行SQL时通过greenlet切换回事件循环 等待数据库时不占用线程
+class AsyncDatabase:
+    def __init__(self, db, app):
+        self.db = db
+        uri = app.config['ASYNC_DATABASE_URI'] or async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = self._create_engine(app, uri)
+        # 同步副本引擎 -> asyncio副本引擎
+        self.replica_engines = {}
+        for index, replica_uri in enumerate(app.config['DATABASE_REPLICA_URIS']):
+            engine = db.get_engine(app, bind='replica_{}'.format(index))
+            self.replica_engines[engine] = self._create_engine(app, async_database_url(replica_uri))
+
+    @staticmethod
+    def _create_engine(app, uri):
+        options = {}
+        if make_url(uri).get_backend_name() != 'sqlite':
+            options = {'pool_size': app.config['DATABASE_POOL_SIZE'],
+                       'max_overflow': app.config['DATABASE_MAX_OVERFLOW'],
+                       'pool_timeout': app.config['DATABASE_POOL_TIMEOUT'],
+                       'pool_recycle': app.config['DATABASE_POOL_RECYCLE'],
+                       'pool_pre_ping': app.config['DATABASE_POOL_PRE_PING']}
+        return create_async_engine(uri, **options)
+
+    # 只读 不提交
+    def session(self):
+        return AsyncSession(bind=self.engine, sync_session_class=AsyncRoutingSession, expire_on_commit=False,
+                            info={'replica_engines': {engine: replica.sync_engine for engine, replica
+                                                      in self.replica_engines.items()}})
+
+    # 在session中执行同步函数fn() fn中的db.session即为该session
+    async def run(self, fn):
+        async with self.session() as session:
+            return await session.run_sync(self._bound, fn)
+
+    def _bound(self, sync_session, fn):
+        # Flask-SQLAlchemy的scoped_session按greenlet区分 run_sync在单独的greenlet中执行
+        self.db.session.registry.set(sync_session)
+        try:
+            return fn()
+        finally:
+            self.db.session.registry.clear()
+
+    async def dispose(self):
+        await self.engine.dispose()
+        for replica in self.replica_engines.values():
+            await replica.dispose()
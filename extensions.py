@@ -1,8 +1,37 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_uploads import UploadSet, IMAGES
 
-db = SQLAlchemy()
+from admission import AdmissionControl
+from blocklist import TokenBlocklist
+from cache import ResponseCache
+from database import RoutingSQLAlchemy
+from jobs import ImageQueue
+from media import MediaUrls
+from outbox import OutboxSender
+from passwords import PasswordHasher
+from profiling import RequestProfiler
+from storage import ImageReclaimer
+
+# 只读请求可发送到只读副本
+db = RoutingSQLAlchemy()
 jwt = JWTManager()
 # IMAGES表示上传的是图像
 image_set = UploadSet('images', IMAGES)
+# GET /recipes 响应缓存
+response_cache = ResponseCache()
+# 图像处理进程池
+image_queue = ImageQueue()
+# 已注销token的黑名单 多进程共享
+token_blocklist = TokenBlocklist()
+# 邮件outbox 后台批量发送
+outbox_sender = OutboxSender()
+# 密码散列进程池
+password_hasher = PasswordHasher()
+# 图像url
+media_urls = MediaUrls()
+# 按请求统计耗时 Server-Timing
+profiler = RequestProfiler()
+# 删除不再被引用的图像
+image_reclaimer = ImageReclaimer()
+# 开销大的请求的限流和并发限制
+admission_control = AdmissionControl()
@@ -0,0 +1,62 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 图像处理进程池 在后台压缩上传的图像 不占用web线程
+# 等待中的任务数有上限 队列已满时由调用方返回503
+# IMAGE_PROCESSING_WORKERS为0时不使用进程池 在请求中直接处理
+class ImageQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 0
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_PROCESSING_WORKERS', 2)
+        app.config.setdefault('IMAGE_PROCESSING_QUEUE_SIZE', 16)
+        self.app = app
+        self.workers = app.config['IMAGE_PROCESSING_WORKERS']
+        self._slots = threading.BoundedSemaphore(app.config['IMAGE_PROCESSING_QUEUE_SIZE'])
+        app.extensions['image_queue'] = self
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    # 第一次提交任务时才创建进程池
+    # 使用spawn 避免fork时复制web进程中的线程和数据库连接
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    # 返回False表示队列已满
+    # on_done(future)在应用上下文中执行
+    def submit(self, fn, args, on_done):
+        if not self._slots.acquire(blocking=False):
+            return False
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._finish(f, on_done))
+        return True
+
+    def _finish(self, future, on_done):
+        self._slots.release()
+        with self.app.app_context():
+            on_done(future)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
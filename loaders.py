@@ -0,0 +1,32 @@
+from flask import g, has_app_context
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.user import User
+
+
+# 每个请求内缓存已加载的作者(User) 同一作者只查询一次
+def get_author_cache():
+    if not has_app_context():
+        return {}
+    if 'authors' not in g:
+        g.authors = {}
+    return g.authors
+
+
+# 将请求中已查询到的用户加入缓存
+def prime_authors(*users):
+    cache = get_author_cache()
+    for user in users:
+        if user is not None:
+            cache[user.id] = user
+
+
+# 一次IN查询加载一页recipe中缺少的作者 并直接赋值给recipe.user 避免逐条lazy load
+def load_authors(recipes):
+    cache = get_author_cache()
+    missing = {recipe.user_id for recipe in recipes if recipe.user_id is not None and recipe.user_id not in cache}
+    if missing:
+        prime_authors(*User.query.filter(User.id.in_(missing)).all())
+    for recipe in recipes:
+        set_committed_value(recipe, 'user', cache.get(recipe.user_id))
+    return recipes
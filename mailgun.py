@@ -1,13 +1,27 @@
+import json
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from profiling import timed
 
 
 class MailgunApi:
     API_URL = 'https://api.mailgun.net/v3/{}/messages'
+    # Mailgun单次批量发送最多1000个收件人
+    MAX_BATCH_SIZE = 1000
 
-    def __init__(self, domain, api_key):
+    # api_url可指向本地的测试服务器
+    # 复用同一个Session的连接 避免每封邮件重新建立TLS连接
+    def __init__(self, domain, api_key, api_url=None, timeout=10):
         self.domain = domain
         self.key = api_key
-        self.base_url = self.API_URL.format(self.domain)
+        self.base_url = (api_url or self.API_URL).format(self.domain)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = ('api', self.key)
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
 
     def send_email(self, to, subject, text, html=None):
         if not isinstance(to, (list, tuple)):
@@ -21,8 +35,28 @@ class MailgunApi:
             'html': html
         }
 
-        response = requests.post(url=self.base_url,
-                                 auth=('api', self.key),
-                                 data=data)
+        with timed('mail'):
+            response = self.session.post(url=self.base_url,
+                                         data=data,
+                                         timeout=self.timeout)
+
+        return response
+
+    # 批量发送 recipients: {邮箱: 变量}
+    # 通过recipient-variables每个收件人单独收到一封邮件 看不到其他收件人 正文中可使用%recipient.变量名%
+    def send_batch(self, recipients, subject, text, html=None):
+        data = {
+            'from': 'SmileCook <no-reply@{}>'.format(self.domain),
+            'to': list(recipients),
+            'subject': subject,
+            'text': text,
+            'html': html,
+            'recipient-variables': json.dumps(recipients)
+        }
+
+        with timed('mail'):
+            response = self.session.post(url=self.base_url,
+                                         data=data,
+                                         timeout=self.timeout)
 
         return response
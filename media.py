@@ -0,0 +1,164 @@
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from PIL import features
+from flask import url_for, request, abort, current_app, _request_ctx_stack
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from profiling import timed
+from variants import VariantCache, variant_key, make_variant
+
+# 按内容hash命名的上传图像 内容不会改变
+HASHED_FILENAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+
+
+# 图像url 基础地址每个应用(MEDIA_BASE_URL)或每个请求只计算一次 之后只做字符串拼接
+# MEDIA_BASE_URL 例如 https://cdn.example.com/static/ 为None时使用本站的static地址
+# MEDIA_ASSET_VERSIONS为True时 默认图像等静态资源的url带上内容hash(?v=) 内容变化时url随之变化 可长期缓存
+# 上传的图像文件名每次都不同 不需要版本号
+# 图像由MEDIA_URL_PATH下的路由提供(见serve) 不经过默认的static路由
+# ?w= 按需生成缩小的变体(JPEG或WebP) 保存在MEDIA_VARIANT_CACHE_DIR 总大小超过MEDIA_VARIANT_CACHE_SIZE时删除最久未使用的
+class MediaUrls:
+    def __init__(self, app=None):
+        self.base_url = None
+        self.asset_versions = {}
+        self.variant_widths = []
+        self.variants = None
+        self.webp = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MEDIA_BASE_URL', None)
+        app.config.setdefault('MEDIA_ASSET_VERSIONS', False)
+        app.config.setdefault('MEDIA_URL_PATH', '/media')
+        app.config.setdefault('MEDIA_MAX_AGE', 3600)
+        app.config.setdefault('MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 3600)
+        app.config.setdefault('MEDIA_SENDFILE', None)
+        app.config.setdefault('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        app.config.setdefault('MEDIA_VARIANT_WIDTHS', (160, 320, 640, 1024))
+        app.config.setdefault('MEDIA_VARIANT_CACHE_DIR', '/tmp/smilecook-variants')
+        app.config.setdefault('MEDIA_VARIANT_CACHE_SIZE', 512 * 1024 * 1024)
+        app.config.setdefault('MEDIA_VARIANT_ACCEL_REDIRECT_PREFIX', '/protected-media-variants/')
+        base_url = app.config['MEDIA_BASE_URL']
+        self.base_url = base_url.rstrip('/') + '/' if base_url else None
+        self.asset_versions = {}
+        self.variant_widths = sorted(app.config['MEDIA_VARIANT_WIDTHS'])
+        self.variants = VariantCache(app.config['MEDIA_VARIANT_CACHE_DIR'], app.config['MEDIA_VARIANT_CACHE_SIZE'])
+        # Pillow编译时未包含libwebp时只返回JPEG
+        self.webp = features.check('webp')
+        if app.config['MEDIA_ASSET_VERSIONS']:
+            self.asset_versions = hash_assets(os.path.join(app.static_folder, 'images', 'assets'))
+        app.extensions['media_urls'] = self
+        app.add_url_rule('{}/<path:filename>'.format(app.config['MEDIA_URL_PATH'].rstrip('/')), 'media', self.serve)
+
+    def get_base_url(self):
+        if self.base_url is not None:
+            return self.base_url
+        # 与请求的host有关 保存在本次请求的environ中 每个图像url都会调用 只查找一次请求上下文
+        ctx = _request_ctx_stack.top
+        if ctx is None:
+            return url_for('media', filename='', _external=True)
+        environ = ctx.request.environ
+        base_url = environ.get('smilecook.media_base_url')
+        if base_url is None:
+            base_url = environ['smilecook.media_base_url'] = url_for('media', filename='', _external=True)
+        return base_url
+
+    def image_url(self, folder, filename):
+        return '{}images/{}/{}'.format(self.get_base_url(), folder, quote(filename))
+
+    def asset_url(self, filename):
+        url = '{}images/assets/{}'.format(self.get_base_url(), filename)
+        version = self.asset_versions.get(filename)
+        return '{}?v={}'.format(url, version) if version else url
+
+    # 图像url的各宽度变体 {'320w': url?w=320, ...} 可用于<img srcset>
+    def srcset(self, url):
+        separator = '&' if '?' in url else '?'
+        return {'{}w'.format(width): '{}{}w={}'.format(url, separator, width) for width in self.variant_widths}
+
+    # images/recipes/...、images/avatars/... 上传的图像 images/assets/... 默认图像
+    # 按hash命名的图像和带当前版本号的默认图像可永久缓存(immutable) 其他图像缓存MEDIA_MAX_AGE秒
+    # 支持条件请求和Range
+    # MEDIA_SENDFILE为x-sendfile(Apache/lighttpd)或x-accel-redirect(nginx)时 只返回响应头 由前端服务器发送文件
+    def serve(self, filename):
+        from extensions import image_set
+
+        parts = filename.split('/', 2)
+        if len(parts) != 3 or parts[0] != 'images':
+            abort(404)
+        _, folder, name = parts
+        if folder == 'assets':
+            directory = os.path.join(current_app.static_folder, 'images', 'assets')
+            version = self.asset_versions.get(name)
+            immutable = version is not None and request.args.get('v') == version
+        elif folder in ('recipes', 'avatars'):
+            directory = image_set.path(filename='', folder=folder)
+            immutable = HASHED_FILENAME.match(name) is not None
+        else:
+            abort(404)
+        path = safe_join(os.path.abspath(directory), name)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        config = current_app.config
+        max_age = config['MEDIA_IMMUTABLE_MAX_AGE'] if immutable else config['MEDIA_MAX_AGE']
+        width = request.args.get('w', type=int)
+        if width is None or not self.variant_widths:
+            return self._send(path, config['MEDIA_ACCEL_REDIRECT_PREFIX'] + quote(filename), max_age, immutable)
+
+        # ?w= 缩小后的变体 宽度取不小于w的最小可选宽度 客户端接受WebP时返回WebP
+        width = next((allowed for allowed in self.variant_widths if allowed >= width), self.variant_widths[-1])
+        fmt = 'webp' if self.webp and accepts_webp() else 'jpeg'
+        extension = 'webp' if fmt == 'webp' else 'jpg'
+        with timed('image'):
+            variant_path = self.variants.get(variant_key(path, width, fmt), extension,
+                                             lambda target_path: make_variant(path, target_path, width, fmt))
+        accel_uri = config['MEDIA_VARIANT_ACCEL_REDIRECT_PREFIX'] + \
+            os.path.relpath(variant_path, self.variants.directory).replace(os.sep, '/')
+        # mtime随使用更新 ETag使用变体key
+        response = self._send(variant_path, accel_uri, max_age, immutable, etag=os.path.basename(variant_path))
+        response.vary.add('Accept')
+        return response
+
+    # accel_uri: nginx中对应文件的internal location
+    def _send(self, path, accel_uri, max_age, immutable, etag=True):
+        config = current_app.config
+        if config['MEDIA_SENDFILE'] == 'x-accel-redirect':
+            response = current_app.response_class(mimetype=mimetypes.guess_type(path)[0])
+            response.headers['X-Accel-Redirect'] = accel_uri
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+        elif config['MEDIA_SENDFILE'] == 'x-sendfile':
+            # Range由前端服务器处理 这里只处理条件请求
+            environ = dict(request.environ)
+            environ.pop('HTTP_RANGE', None)
+            response = send_file(path, environ, max_age=max_age, conditional=True, etag=etag,
+                                 use_x_sendfile=True, response_class=current_app.response_class)
+        else:
+            response = send_file(path, request.environ, max_age=max_age, conditional=True, etag=etag,
+                                 response_class=current_app.response_class)
+            response.headers.setdefault('Accept-Ranges', 'bytes')
+        if immutable:
+            response.cache_control.immutable = True
+        return response
+
+
+# 只在Accept中明确列出image/webp时返回WebP */*不算
+def accepts_webp():
+    return any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+
+
+def hash_assets(folder):
+    versions = {}
+    if not os.path.isdir(folder):
+        return versions
+    for filename in os.listdir(folder):
+        with open(os.path.join(folder, filename), 'rb') as asset:
+            versions[filename] = hashlib.sha1(asset.read()).hexdigest()[:10]
+    return versions
@@ -0,0 +1,43 @@
+"""recipe listing indexes
+
+Revision ID: 5a7c9e1f3b28
+Revises: 2f8d4a6c1b93
+Create Date: 2026-10-18 17:20:11.842706
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5a7c9e1f3b28'
+down_revision = '2f8d4a6c1b93'
+branch_labels = None
+depends_on = None
+
+# 与models/indexes.py中的RECIPE_INDEXES一致
+INDEXES = [
+    ('ix_recipe_user_id_created_at', 'user_id, created_at NULLS FIRST, id', False),
+    ('ix_recipe_user_id_is_publish_created_at', 'user_id, is_publish, created_at NULLS FIRST, id', False),
+    ('ix_recipe_published_created_at', 'created_at NULLS FIRST, id', True),
+    ('ix_recipe_published_cook_time', 'cook_time NULLS FIRST, id', True),
+    ('ix_recipe_published_num_of_servings', 'num_of_servings NULLS FIRST, id', True),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # CONCURRENTLY 建索引时不锁表 不能在事务中执行
+        with op.get_context().autocommit_block():
+            for name, columns, published_only in INDEXES:
+                op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON recipe ({}){}'.format(
+                    name, columns, ' WHERE is_publish = true' if published_only else ''))
+    elif dialect == 'sqlite':
+        for name, columns, published_only in INDEXES:
+            op.execute('CREATE INDEX {} ON recipe ({}){}'.format(
+                name, columns.replace(' NULLS FIRST', ''), ' WHERE is_publish = 1' if published_only else ''))
+
+
+def downgrade():
+    for name, _, _ in INDEXES:
+        op.drop_index(name, table_name='recipe')
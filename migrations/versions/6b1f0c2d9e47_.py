@@ -0,0 +1,43 @@
+"""recipe full-text search index
+
+Revision ID: 6b1f0c2d9e47
+Revises: d449c6f323bd
+Create Date: 2026-10-18 10:12:41.305118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1f0c2d9e47'
+down_revision = 'd449c6f323bd'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = "setweight(to_tsvector('english', coalesce(name, '')), 'A') || " \
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B') || " \
+                "setweight(to_tsvector('english', coalesce(ingredients, '')), 'C')"
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.add_column('recipe', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute('UPDATE recipe SET search_vector = {}'.format(SEARCH_VECTOR))
+        op.create_index('ix_recipe_search_vector', 'recipe', ['search_vector'], unique=False,
+                        postgresql_using='gin')
+    elif dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE recipe_fts USING fts5(name, description, ingredients)')
+        op.execute('INSERT INTO recipe_fts (rowid, name, description, ingredients) '
+                   'SELECT id, name, description, ingredients FROM recipe')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_recipe_search_vector', table_name='recipe')
+        op.drop_column('recipe', 'search_vector')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE recipe_fts')
@@ -0,0 +1,32 @@
+"""user recipe counters
+
+Revision ID: 8d2b6f4e0a17
+Revises: 5a7c9e1f3b28
+Create Date: 2026-10-18 18:05:42.517390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b6f4e0a17'
+down_revision = '5a7c9e1f3b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user', sa.Column('published_recipe_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('user', sa.Column('private_recipe_count', sa.Integer(), server_default='0', nullable=False))
+    # 根据已有的recipe填充计数
+    op.execute('UPDATE "user" SET '
+               'published_recipe_count = (SELECT count(*) FROM recipe '
+               'WHERE recipe.user_id = "user".id AND recipe.is_publish = true), '
+               'private_recipe_count = (SELECT count(*) FROM recipe '
+               'WHERE recipe.user_id = "user".id AND (recipe.is_publish = false OR recipe.is_publish IS NULL))')
+
+
+def downgrade():
+    op.drop_column('user', 'private_recipe_count')
+    op.drop_column('user', 'published_recipe_count')
@@ -0,0 +1,28 @@
+import csv
+import io
+
+from extensions import db
+
+
+# 批量插入 rows为dict列表 缺少的列写入NULL
+# PostgreSQL使用COPY 其他数据库使用executemany(一条语句插入多行)
+def insert_rows(table, columns, rows):
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(table, columns, rows)
+    else:
+        db.session.execute(table.insert(), [{column: row.get(column) for column in columns} for row in rows])
+
+
+# 在当前session的事务中执行COPY FROM STDIN
+# QUOTE_NONNUMERIC: 字符串加引号 None写为空字段(NULL) 空字符串写为""
+def copy_rows(table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for row in rows:
+        writer.writerow([row.get(column) for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table.name, ', '.join(columns)), buffer)
+    finally:
+        cursor.close()
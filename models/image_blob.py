@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+
+
+# 按内容hash命名的图像文件 filename为 ab/cd/<sha256>.jpg (folder下的相对路径)
+# refcount: 引用该文件的Recipe.cover_image和User.avatar_image数 与引用在同一事务中增减
+# released_at: 最后一次减少引用的时间 refcount为0且超过宽限期后由ImageReclaimer删除文件
+# 旧的uuid文件名没有记录 不再被引用时以refcount=0加入 同样由ImageReclaimer删除
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blob'
+    __table_args__ = (db.Index('ix_image_blob_unreferenced', 'refcount', 'released_at'), )
+    folder = db.Column(db.String(20), primary_key=True)
+    filename = db.Column(db.String(100), primary_key=True)
+    refcount = db.Column(db.Integer(), nullable=False, default=0)
+    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
+    released_at = db.Column(db.DateTime())
+
+    # 已有相同内容的文件时增加引用并返回True
+    @classmethod
+    def acquire(cls, folder, filename):
+        result = db.session.execute(db.update(cls).where(cls.folder == folder, cls.filename == filename).values(
+            refcount=cls.refcount + 1).execution_options(synchronize_session=False))
+        return result.rowcount > 0
+
+    # 新写入的文件 同时上传相同内容时只有一个请求能插入 其他请求增加引用
+    @classmethod
+    def add_reference(cls, folder, filename):
+        if cls.acquire(folder, filename):
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(folder=folder, filename=filename, refcount=1))
+        except IntegrityError:
+            cls.acquire(folder, filename)
+
+    # 只加入session 由调用方与图像字段的修改一起提交
+    @classmethod
+    def release(cls, folder, filename):
+        result = db.session.execute(db.update(cls).where(cls.folder == folder, cls.filename == filename).values(
+            refcount=cls.refcount - 1, released_at=datetime.utcnow()).execution_options(synchronize_session=False))
+        if result.rowcount > 0:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(folder=folder, filename=filename, refcount=0, released_at=datetime.utcnow()))
+        except IntegrityError:
+            pass
+
+    # 多个进程同时清理时 跳过其他进程已锁定的行(PostgreSQL)
+    @classmethod
+    def get_unreferenced(cls, released_before, limit):
+        return cls.query.filter(cls.refcount <= 0, cls.released_at < released_before). \
+            limit(limit).with_for_update(skip_locked=True).all()
+
+    # 再次确认没有引用后删除记录 返回是否删除
+    # 此后增加引用的请求找不到记录 会重新写入文件
+    @classmethod
+    def delete_unreferenced(cls, folder, filename, released_before):
+        return cls.query.filter(cls.folder == folder, cls.filename == filename, cls.refcount <= 0,
+                                cls.released_at < released_before). \
+            delete(synchronize_session=False) > 0
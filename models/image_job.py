@@ -0,0 +1,30 @@
+from extensions import db
+
+
+# 后台图像处理任务
+# folder: recipes(recipe封面) 或 avatars(用户图标)
+# status: pending 处理中 done 已完成 failed 失败
+# filename: 处理完成后的图像文件名
+class ImageJob(db.Model):
+    __tablename__ = 'image_job'
+    id = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer(), db.ForeignKey("user.id"), nullable=False)
+    recipe_id = db.Column(db.Integer())
+    folder = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    filename = db.Column(db.String(100))
+    message = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
+    @classmethod
+    def get_by_id(cls, job_id):
+        return cls.query.filter_by(id=job_id).first()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
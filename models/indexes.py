@@ -0,0 +1,38 @@
+from sqlalchemy import DDL, event
+
+# recipe列表查询使用的索引 (名称, 列, 是否只包含已发布的recipe)
+# get_all_by_user: user_id (+ is_publish) 按 created_at, id 排序
+# get_all_published: 已发布的recipe 按 created_at / cook_time / num_of_servings, id 排序
+# 排序列为NULLS FIRST: 正向扫描对应 ASC NULLS FIRST 反向扫描对应 DESC NULLS LAST 与keyset_order()一致
+# SQLite中NULL本身就是最小值 且索引不支持NULLS FIRST 创建时去掉
+RECIPE_INDEXES = [
+    ('ix_recipe_user_id_created_at', 'user_id, created_at NULLS FIRST, id', False),
+    ('ix_recipe_user_id_is_publish_created_at', 'user_id, is_publish, created_at NULLS FIRST, id', False),
+    ('ix_recipe_published_created_at', 'created_at NULLS FIRST, id', True),
+    ('ix_recipe_published_cook_time', 'cook_time NULLS FIRST, id', True),
+    ('ix_recipe_published_num_of_servings', 'num_of_servings NULLS FIRST, id', True),
+]
+
+# 与查询中的 is_publish = true 条件一致 否则不会使用部分索引
+PUBLISHED_CONDITION = {
+    'postgresql': 'is_publish = true',
+    'sqlite': 'is_publish = 1',
+}
+
+
+def create_index_sql(dialect, table_name, name, columns, published_only):
+    if dialect != 'postgresql':
+        columns = columns.replace(' NULLS FIRST', '')
+    sql = 'CREATE INDEX {} ON {} ({})'.format(name, table_name, columns)
+    if published_only:
+        sql += ' WHERE {}'.format(PUBLISHED_CONDITION.get(dialect, 'is_publish = true'))
+    return sql
+
+
+# db.create_all()创建表后 同时创建这些索引 已有数据库通过migrations升级
+def register_index_ddl(table, indexes):
+    for dialect in PUBLISHED_CONDITION:
+        for name, columns, published_only in indexes:
+            event.listen(table, 'after_create',
+                         DDL(create_index_sql(dialect, table.name, name, columns, published_only))
+                         .execute_if(dialect=dialect))
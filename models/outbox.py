@@ -0,0 +1,41 @@
+import json
+from datetime import datetime
+
+from extensions import db
+
+
+# 待发送的邮件 与业务数据在同一事务中写入 由后台线程发送
+# variables: 收件人变量(JSON) 正文中使用%recipient.变量名%引用 内容相同的邮件可以合并批量发送
+# status: pending 待发送 sent 已发送 failed 重试次数用完
+class OutboxEmail(db.Model):
+    __tablename__ = 'outbox_email'
+    __table_args__ = (db.Index('ix_outbox_email_pending', 'status', 'next_attempt_at'), )
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    text = db.Column(db.Text(), nullable=False)
+    html = db.Column(db.Text())
+    variables = db.Column(db.Text())
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer(), nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
+    sent_at = db.Column(db.DateTime())
+
+    def get_variables(self):
+        return json.loads(self.variables) if self.variables else {}
+
+    # 多个进程同时发送时 跳过其他进程已锁定的行(PostgreSQL)
+    @classmethod
+    def get_due(cls, limit):
+        return cls.query.filter(cls.status == 'pending', cls.next_attempt_at <= datetime.utcnow()). \
+            order_by(cls.id).limit(limit).with_for_update(skip_locked=True).all()
+
+    # 只加入session 由调用方与业务数据一起提交
+    @classmethod
+    def add(cls, recipient, subject, text, html=None, variables=None):
+        email = cls(recipient=recipient, subject=subject, text=text, html=html,
+                    variables=json.dumps(variables) if variables else None)
+        db.session.add(email)
+        return email
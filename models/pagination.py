@@ -0,0 +1,123 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, or_, literal, DateTime
+
+from extensions import db
+
+
+# 游标(keyset)分页 不使用OFFSET和COUNT(*) 第N页与第1页开销相同
+# 排序为 (排序列, id)，NULL视为最小值
+# cursor内容: [排序列名, 排序值, id, 方向(next/prev)]，base64编码后对客户端不透明
+class KeysetPagination:
+    def __init__(self, items, per_page, sort_column, has_next, has_prev):
+        self.items = items
+        self.per_page = per_page
+        self.sort_column = sort_column
+        self.has_next = has_next and bool(items)
+        self.has_prev = has_prev and bool(items)
+
+    @property
+    def next_cursor(self):
+        if self.has_next:
+            return encode_cursor(self.sort_column, self.items[-1], 'next')
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev:
+            return encode_cursor(self.sort_column, self.items[0], 'prev')
+
+
+def encode_cursor(sort_column, item, direction):
+    value = getattr(item, sort_column.key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort_column.key, value, item.id, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+# cursor无效或与当前排序列不匹配时抛出ValueError
+def decode_cursor(cursor, sort_column):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, value, last_id, direction = json.loads(payload)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if sort != sort_column.key or direction not in ('next', 'prev') or not isinstance(last_id, int):
+        raise ValueError('Invalid cursor')
+    if value is None:
+        return value, last_id, direction
+    # 排序值的类型必须与排序列相同 否则比较时数据库报错(PostgreSQL)
+    if isinstance(sort_column.type, DateTime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+    elif not isinstance(value, sort_column.type.python_type) or isinstance(value, bool):
+        raise ValueError('Invalid cursor')
+    return value, last_id, direction
+
+
+# SQLite中server_default(CURRENT_TIMESTAMP)写入的时间是不带微秒的文本 绑定参数需保持相同格式才能比较
+def keyset_value(value):
+    if isinstance(value, datetime) and not value.microsecond and db.engine.dialect.name == 'sqlite':
+        return literal(value.strftime('%Y-%m-%d %H:%M:%S'))
+    return value
+
+
+def keyset_order(sort_column, id_column, ascending):
+    if ascending:
+        return sort_column.asc().nullsfirst(), id_column.asc()
+    return sort_column.desc().nullslast(), id_column.desc()
+
+
+# 排序方向上位于 (value, last_id) 之后的行
+def keyset_after(sort_column, id_column, value, last_id, ascending):
+    if ascending:
+        if value is None:
+            return or_(sort_column.isnot(None), and_(sort_column.is_(None), id_column > last_id))
+        return or_(sort_column > value, and_(sort_column == value, id_column > last_id))
+    if value is None:
+        return and_(sort_column.is_(None), id_column < last_id)
+    return or_(sort_column.is_(None), sort_column < value, and_(sort_column == value, id_column < last_id))
+
+
+# 每页数量 小于1时返回None(请求无效) 超过RECIPE_PER_PAGE_MAX时取最大值
+def page_size(per_page):
+    if per_page < 1:
+        return None
+    return min(per_page, current_app.config['RECIPE_PER_PAGE_MAX'])
+
+
+# cursor为空字符串时返回第一页
+def keyset_paginate(query, sort_column, id_column, order, cursor, per_page):
+    ascending = order == 'asc'
+    direction = 'next'
+    if cursor:
+        value, last_id, direction = decode_cursor(cursor, sort_column)
+        value = keyset_value(value)
+        # 向前翻页时反向扫描
+        if direction == 'prev':
+            ascending = not ascending
+        query = query.filter(keyset_after(sort_column, id_column, value, last_id, ascending))
+    # 多取一行用于判断是否还有下一页
+    items = query.order_by(*keyset_order(sort_column, id_column, ascending)).limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'prev':
+        items.reverse()
+        return KeysetPagination(items, per_page, sort_column, has_next=True, has_prev=has_more)
+    return KeysetPagination(items, per_page, sort_column, has_next=has_more, has_prev=bool(cursor))
+
+
+# 与query.paginate()相同 但使用已知的总数 不执行COUNT(*)
+def paginate_with_total(query, page, per_page, total):
+    if page < 1 or per_page < 0:
+        abort(404)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if not items and page != 1:
+        abort(404)
+    return Pagination(query, page, per_page, total, items)
@@ -1,6 +1,13 @@
-from sqlalchemy import desc, or_, asc
+from sqlalchemy import desc, func
 
-from extensions import db
+from extensions import db, response_cache
+from loaders import load_authors
+from models.bulk import insert_rows
+from models.image_blob import ImageBlob
+from models.indexes import RECIPE_INDEXES, register_index_ddl
+from models.pagination import keyset_paginate, keyset_order, paginate_with_total
+from models.user import User
+from search import recipe_search, register_search_ddl
 
 
 class Recipe(db.Model):
@@ -18,43 +25,149 @@ class Recipe(db.Model):
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"))
     cover_image = db.Column(db.String(100), default=None)
 
+    # 批量导入时写入的列
+    BULK_COLUMNS = ('name', 'description', 'num_of_servings', 'cook_time', 'ingredients', 'directions',
+                    'is_publish', 'user_id')
+
     @classmethod
     def get_by_id(cls, recipe_id):
         return cls.query.filter_by(id=recipe_id).first()
 
+    # 一次IN查询获取多个recipe 并批量加载作者 返回{id: recipe}
+    @classmethod
+    def get_by_ids(cls, recipe_ids):
+        recipes = cls.query.filter(cls.id.in_(set(recipe_ids))).all()
+        load_authors(recipes)
+        return {recipe.id: recipe for recipe in recipes}
+
+    # 只查询条件请求(ETag/Last-Modified)和权限判断所需的列
+    @classmethod
+    def get_freshness(cls, recipe_id):
+        return db.session.query(cls.id, cls.user_id, cls.is_publish, cls.updated_at,
+                                User.updated_at.label('author_updated_at')). \
+            outerjoin(User, User.id == cls.user_id).filter(cls.id == recipe_id).first()
+
     # 默认public
     # public 查看所有published private 查看所有unpublished
     # 否则查看所有
+    # cursor不为None时使用游标分页
     @classmethod
-    def get_all_by_user(cls, user_id, page, per_page, visibility='public'):
+    def query_by_user(cls, user_id, visibility='public'):
         query = cls.query.filter_by(user_id=user_id)
         if visibility == 'public':
             query = cls.query.filter_by(user_id=user_id, is_publish=True)
         elif visibility == 'private':
             query = cls.query.filter_by(user_id=user_id, is_publish=False)
-        # 分页显示
-        return query.order_by(desc(cls.created_at)).paginate(page=page, per_page=per_page)
+        return query
+
+    # total为已知的总数(User的recipe计数)时 分页不再执行COUNT(*)
+    @classmethod
+    def get_all_by_user(cls, user_id, page, per_page, visibility='public', cursor=None, total=None):
+        query = cls.query_by_user(user_id, visibility)
+        if cursor is not None:
+            paginated_recipes = keyset_paginate(query, cls.created_at, cls.id, 'desc', cursor, per_page)
+        else:
+            # 分页显示 排序与游标分页相同 可以使用索引
+            query = query.order_by(*keyset_order(cls.created_at, cls.id, False))
+            if total is None:
+                paginated_recipes = query.paginate(page=page, per_page=per_page)
+            else:
+                paginated_recipes = paginate_with_total(query, page, per_page, total)
+        # 批量加载作者
+        load_authors(paginated_recipes.items)
+        return paginated_recipes
+
+    # 导出用户的全部recipe 按id顺序逐批读取
+    # PostgreSQL使用服务端游标(stream_results) 内存中最多保留batch_size行
+    @classmethod
+    def iter_by_user(cls, user_id, visibility='public', batch_size=1000):
+        return cls.query_by_user(user_id, visibility).order_by(cls.id). \
+            execution_options(stream_results=True).yield_per(batch_size)
 
-    # 根据关键字搜索name和description
+    # 根据关键字全文检索name、description和ingredients
+    # sort为relevance时按相关度排序
+    # cursor不为None时使用游标分页 只支持按列排序
     @classmethod
-    def get_all_published(cls, q, page, per_page, sort, order):
-        keyword = '%{keyword}%'.format(keyword=q)
-        # asc (ascending order) or desc (descending order)
-        # 升序和降序
-        if order == 'asc':
-            sort_logic = asc(getattr(cls, sort))
+    def get_all_published(cls, q, page, per_page, sort, order, cursor=None):
+        # 使用 is_publish = true 与部分索引的条件一致
+        query = cls.query.filter_by(is_publish=True)
+        rank_logic = None
+        if q.strip():
+            query, rank_logic = recipe_search().match(cls, query, q)
+        if cursor is not None:
+            paginated_recipes = keyset_paginate(query, getattr(cls, sort), cls.id, order, cursor, per_page)
         else:
-            sort_logic = desc(getattr(cls, sort))
-        return cls.query.filter(or_(cls.name.ilike(keyword),
-                                    cls.description.ilike(keyword),
-                                    cls.ingredients.ilike(keyword)),
-                                cls.is_publish.is_(True)). \
-            order_by(sort_logic).paginate(page=page, per_page=per_page)
+            # asc (ascending order) or desc (descending order)
+            # 升序和降序 按列排序时与游标分页相同(id同向 NULL视为最小值) 可以使用索引
+            if sort == 'relevance' and rank_logic is not None:
+                sort_logic = (rank_logic, desc(cls.id))
+            else:
+                sort_logic = keyset_order(getattr(cls, sort), cls.id, order == 'asc')
+            paginated_recipes = query.order_by(*sort_logic).paginate(page=page, per_page=per_page)
+        # 批量加载作者
+        load_authors(paginated_recipes.items)
+        return paginated_recipes
 
+    # 与recipe在同一事务中更新检索索引
+    # 已发布的数据发生变化时 使recipe列表的响应缓存失效
+    # 新建或发布状态变化时更新作者的recipe计数
     def save(self):
+        state = db.inspect(self)
+        is_new = not state.persistent
+        publish_history = state.attrs.is_publish.history
+        published_changed = self.is_publish or publish_history.has_changes()
         db.session.add(self)
+        db.session.flush()
+        if is_new:
+            User.add_recipe_counts(self.user_id, published=int(self.is_publish), private=int(not self.is_publish))
+        elif publish_history.deleted and bool(publish_history.deleted[0]) != bool(self.is_publish):
+            change = 1 if self.is_publish else -1
+            User.add_recipe_counts(self.user_id, published=change, private=-change)
+        recipe_search().index(self)
+        db.session.commit()
+        if published_changed:
+            response_cache.bump('recipes')
+
+    # 批量导入 一批一个事务 不逐行save
+    # 导入的recipe未发布 不影响recipe列表缓存
+    @classmethod
+    def bulk_insert(cls, rows):
+        after_id = db.session.query(func.max(cls.id)).scalar() or 0
+        insert_rows(cls.__table__, cls.BULK_COLUMNS, rows)
+        recipe_search().index_new(after_id)
+        counts = {}
+        for row in rows:
+            published, private = counts.get(row['user_id'], (0, 0))
+            counts[row['user_id']] = (published + 1, private) if row['is_publish'] else (published, private + 1)
+        for user_id, (published, private) in counts.items():
+            User.add_recipe_counts(user_id, published=published, private=private)
         db.session.commit()
 
     def delete(self):
+        was_published = self.is_publish
+        if self.cover_image:
+            ImageBlob.release('recipes', self.cover_image)
+        recipe_search().remove(self)
         db.session.delete(self)
+        User.add_recipe_counts(self.user_id, published=-int(bool(was_published)), private=-int(not was_published))
         db.session.commit()
+        if was_published:
+            response_cache.bump('recipes')
+
+    # 按recipe表重新计算所有用户的计数 只更新与实际不一致的用户 返回更新的用户数 updated_at不变
+    @classmethod
+    def repair_user_counts(cls):
+        published = db.session.query(func.count(cls.id)). \
+            filter(cls.user_id == User.id, cls.is_publish.is_(True)).scalar_subquery()
+        private = db.session.query(func.count(cls.id)). \
+            filter(cls.user_id == User.id, cls.is_publish.isnot(True)).scalar_subquery()
+        result = db.session.execute(db.update(User).where(
+            (User.published_recipe_count != published) | (User.private_recipe_count != private)).values(
+            published_recipe_count=published, private_recipe_count=private, updated_at=User.updated_at).
+            execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+
+register_search_ddl(Recipe.__table__)
+register_index_ddl(Recipe.__table__, RECIPE_INDEXES)
@@ -1,4 +1,4 @@
-from extensions import db
+from extensions import db, response_cache
 
 
 # id: The identity of a user.
@@ -23,9 +23,36 @@ class User(db.Model):
     is_active = db.Column(db.Boolean(), default=False)
     created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
     updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    # 已发布和未发布的recipe数 由Recipe.save/delete/bulk_insert在同一事务中增减
+    published_recipe_count = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+    private_recipe_count = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
     # 与Recipe模型建立关系， 参考user表
     recipes = db.relationship('Recipe', backref='user')
 
+    # 尚未写入数据库的用户计数为None
+    @property
+    def recipe_count(self):
+        return (self.published_recipe_count or 0) + (self.private_recipe_count or 0)
+
+    # 与Recipe.query_by_user的visibility相同
+    def get_recipe_count(self, visibility='public'):
+        if visibility == 'public':
+            return self.published_recipe_count
+        elif visibility == 'private':
+            return self.private_recipe_count
+        return self.recipe_count
+
+    # 用UPDATE ... SET count = count + n 增减计数 并发写入时不会丢失
+    # updated_at保持不变(不触发onupdate) 计数另外计入用户信息的ETag 见get_freshness_by_*
+    @classmethod
+    def add_recipe_counts(cls, user_id, published=0, private=0):
+        if user_id is None or (not published and not private):
+            return
+        db.session.execute(db.update(cls).where(cls.id == user_id).values(
+            published_recipe_count=cls.published_recipe_count + published,
+            private_recipe_count=cls.private_recipe_count + private,
+            updated_at=cls.updated_at).execution_options(synchronize_session=False))
+
     @classmethod
     def get_by_username(cls, username):
         return cls.query.filter_by(username=username).first()
@@ -38,7 +65,24 @@ class User(db.Model):
     def get_by_id(cls, id):
         return cls.query.filter_by(id=id).first()
 
+    # 只查询条件请求(ETag/Last-Modified)所需的列 recipe计数变化时updated_at不变 需要计入ETag
+    @classmethod
+    def get_freshness_by_username(cls, username):
+        return db.session.query(cls.id, cls.updated_at, cls.published_recipe_count, cls.private_recipe_count) \
+            .filter(cls.username == username).first()
+
+    @classmethod
+    def get_freshness_by_id(cls, id):
+        return db.session.query(cls.id, cls.updated_at, cls.published_recipe_count, cls.private_recipe_count) \
+            .filter(cls.id == id).first()
+
+    # 作者信息嵌在recipe列表中 用户名或图标变化时使缓存失效
     def save(self):
+        state = db.inspect(self)
+        author_changed = state.persistent and (state.attrs.username.history.has_changes() or
+                                               state.attrs.avatar_image.history.has_changes())
         db.session.add(self)
         db.session.commit()
+        if author_changed:
+            response_cache.bump('recipes')
 
@@ -0,0 +1,93 @@
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from mailgun import MailgunApi
+
+
+# 后台发送outbox_email中的邮件
+# 内容相同的邮件合并为一次Mailgun请求 失败后按指数退避重试
+class OutboxSender:
+    def __init__(self, app=None):
+        self.app = None
+        self.mailgun = None
+        self._event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_OUTBOX_ENABLED', True)
+        app.config.setdefault('MAIL_OUTBOX_POLL_INTERVAL', 5)
+        app.config.setdefault('MAIL_OUTBOX_BATCH_SIZE', 100)
+        app.config.setdefault('MAIL_OUTBOX_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_OUTBOX_RETRY_DELAY', 30)
+        self.app = app
+        self.mailgun = MailgunApi(domain=app.config.get('MAILGUN_DOMAIN'),
+                                  api_key=app.config.get('MAILGUN_API_KEY'),
+                                  api_url=app.config.get('MAILGUN_API_URL'))
+        app.extensions['outbox_sender'] = self
+        if app.config['MAIL_OUTBOX_ENABLED']:
+            app.before_request(self.start)
+
+    # 第一个请求时启动后台线程
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='outbox-sender', daemon=True)
+                self._thread.start()
+
+    # 有新邮件写入后立即发送 不必等待下一次轮询
+    def wake(self):
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait(self.app.config['MAIL_OUTBOX_POLL_INTERVAL'])
+            self._event.clear()
+            try:
+                with self.app.app_context():
+                    self.send_pending()
+            except Exception:
+                self.app.logger.exception('Failed to send outbox emails')
+
+    def send_pending(self):
+        from extensions import db
+        from models.outbox import OutboxEmail
+
+        batch_size = min(self.app.config['MAIL_OUTBOX_BATCH_SIZE'], MailgunApi.MAX_BATCH_SIZE)
+        while True:
+            emails = OutboxEmail.get_due(limit=batch_size)
+            if not emails:
+                db.session.commit()
+                return
+            key = lambda email: (email.subject, email.text, email.html or '')
+            for _, group in groupby(sorted(emails, key=key), key=key):
+                self._send_group(list(group))
+            db.session.commit()
+
+    def _send_group(self, emails):
+        first = emails[0]
+        recipients = {email.recipient: email.get_variables() for email in emails}
+        try:
+            response = self.mailgun.send_batch(recipients=recipients, subject=first.subject,
+                                               text=first.text, html=first.html)
+            error = None if response.ok else 'HTTP {}: {}'.format(response.status_code, response.text[:150])
+        except Exception as exc:
+            error = str(exc)[:200]
+        now = datetime.utcnow()
+        for email in emails:
+            email.attempts += 1
+            if error is None:
+                email.status = 'sent'
+                email.sent_at = now
+                continue
+            email.last_error = error
+            if email.attempts >= self.app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+                email.status = 'failed'
+            else:
+                delay = self.app.config['MAIL_OUTBOX_RETRY_DELAY'] * 2 ** (email.attempts - 1)
+                email.next_attempt_at = now + timedelta(seconds=delay)
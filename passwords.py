@@ -0,0 +1,121 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from passlib.context import CryptContext
+from passlib.hash import pbkdf2_sha256
+
+from profiling import timed
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# 每个rounds对应一个CryptContext 在子进程中缓存
+# 低于rounds的旧散列在验证通过后需要升级
+@lru_cache(maxsize=8)
+def get_context(rounds):
+    return CryptContext(schemes=['pbkdf2_sha256'],
+                        pbkdf2_sha256__default_rounds=rounds,
+                        pbkdf2_sha256__min_rounds=rounds)
+
+
+def hash_in_worker(password, rounds):
+    return get_context(rounds).hash(password)
+
+
+# 返回 (是否正确, 新散列)，不需要升级时新散列为None
+def verify_in_worker(password, hashed, rounds):
+    try:
+        return get_context(rounds).verify_and_update(password, hashed)
+    except ValueError:
+        # 无法识别的散列
+        return False, None
+
+
+# 测量本机上达到目标耗时所需的rounds 取1000的整数倍 避免每次启动的测量误差导致反复升级散列
+def calibrate_rounds(target_ms, min_rounds, sample_rounds=20000):
+    elapsed = min(_time_hash(sample_rounds) for _ in range(3))
+    rounds = int(sample_rounds * target_ms / 1000 / elapsed) // 1000 * 1000
+    return max(rounds, min_rounds)
+
+
+def _time_hash(rounds):
+    start = time.perf_counter()
+    pbkdf2_sha256.using(rounds=rounds).hash('calibration')
+    return time.perf_counter() - start
+
+
+# 密码散列进程池 散列和验证不占用web进程的GIL 等待结果时其他请求线程可以继续执行
+# 同时进行的散列数有上限 超过时等待 等待超时抛出PasswordHasherBusy
+# PASSWORD_HASH_WORKERS为0时在请求中直接计算
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 0
+        self.timeout = 5
+        self._rounds = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_SIZE', 32)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_TIMEOUT', 5)
+        app.config.setdefault('PASSWORD_HASH_ROUNDS', None)
+        app.config.setdefault('PASSWORD_HASH_TARGET_MS', 100)
+        app.config.setdefault('PASSWORD_HASH_MIN_ROUNDS', 29000)
+        self.app = app
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        self._rounds = app.config['PASSWORD_HASH_ROUNDS']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE_SIZE'])
+        app.extensions['password_hasher'] = self
+
+    # 未配置PASSWORD_HASH_ROUNDS时 第一次使用时根据PASSWORD_HASH_TARGET_MS测量
+    @property
+    def rounds(self):
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = calibrate_rounds(self.app.config['PASSWORD_HASH_TARGET_MS'],
+                                                    self.app.config['PASSWORD_HASH_MIN_ROUNDS'])
+        return self._rounds
+
+    # 使用spawn 避免fork时复制web进程中的线程和数据库连接
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    # 计时包含等待进程池空位的时间
+    def _call(self, fn, *args):
+        with timed('password'):
+            if self.workers <= 0:
+                return fn(*args)
+            if not self._slots.acquire(timeout=self.timeout):
+                raise PasswordHasherBusy()
+            try:
+                return self._get_executor().submit(fn, *args).result()
+            finally:
+                self._slots.release()
+
+    def hash(self, password):
+        return self._call(hash_in_worker, password, self.rounds)
+
+    def verify_and_update(self, password, hashed):
+        return self._call(verify_in_worker, password, hashed, self.rounds)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
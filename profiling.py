@@ -0,0 +1,141 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, request, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('smilecook.profile')
+
+
+# 一个请求中各部分的耗时(秒)和次数
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.counts = {}
+        self.active = set()
+        self.cprofile = None
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def current_profile():
+    if has_app_context():
+        return g.get('profile')
+    return None
+
+
+# 统计代码块的耗时 未开启PROFILING_ENABLED时不做任何事
+# 同名的计时嵌套时(例如嵌套schema的dump)只统计最外层
+@contextmanager
+def timed(name):
+    profile = current_profile()
+    if profile is None or name in profile.active:
+        yield
+        return
+    profile.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.active.discard(name)
+        profile.add(name, time.perf_counter() - start)
+
+
+# 多个来源(profiling、admission)的指标合并为一个Server-Timing响应头
+def add_server_timing(response, *metrics):
+    existing = response.headers.get('Server-Timing')
+    response.headers['Server-Timing'] = ', '.join(([existing] if existing else []) + list(metrics))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile() is not None:
+        conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    starts = conn.info.get('profile_query_start')
+    if profile is not None and starts:
+        profile.add('sql', time.perf_counter() - starts.pop())
+
+
+# 按请求统计SQL语句数和耗时、schema序列化、图像处理、密码散列和发送邮件的耗时
+# 结果写入Server-Timing响应头和一行JSON日志(smilecook.profile)
+# 超过PROFILING_BUDGET_MS的请求中 按PROFILING_SAMPLE_RATE抽样保存cProfile结果到PROFILING_DIR
+# 流式响应(导出)在返回响应后生成内容 这部分时间不计入
+class RequestProfiler:
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILING_ENABLED', False)
+        app.config.setdefault('PROFILING_BUDGET_MS', 500)
+        app.config.setdefault('PROFILING_SAMPLE_RATE', 0.1)
+        app.config.setdefault('PROFILING_DIR', '/tmp/smilecook-profiles')
+        self.app = app
+        app.extensions['profiler'] = self
+        if not app.config['PROFILING_ENABLED']:
+            return
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    # 是否超出预算在请求结束时才知道 因此事先按抽样率开启cProfile
+    def start(self):
+        profile = g.profile = RequestProfile()
+        if random.random() < self.app.config['PROFILING_SAMPLE_RATE']:
+            profile.cprofile = cProfile.Profile()
+            profile.cprofile.enable()
+
+    def finish(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        total = time.perf_counter() - profile.start
+        if profile.cprofile is not None:
+            profile.cprofile.disable()
+        over_budget = total * 1000 > self.app.config['PROFILING_BUDGET_MS']
+        dump_path = None
+        if over_budget and profile.cprofile is not None:
+            dump_path = self.dump(profile.cprofile)
+
+        metrics = ['{};dur={:.2f};desc="{}"'.format(name, seconds * 1000, profile.counts[name])
+                   for name, seconds in sorted(profile.timings.items())]
+        metrics.append('total;dur={:.2f}'.format(total * 1000))
+        add_server_timing(response, *metrics)
+
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'timings_ms': {name: round(seconds * 1000, 2) for name, seconds in profile.timings.items()},
+            'counts': profile.counts,
+            'over_budget': over_budget,
+            'admission': g.get('admission'),
+            'profile': dump_path,
+        }))
+        return response
+
+    def dump(self, cprofile):
+        folder = self.app.config['PROFILING_DIR']
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, '{}-{}-{}-{}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), request.method, request.endpoint or 'unknown', uuid.uuid4().hex[:8]))
+        cprofile.dump_stats(path)
+        return path
@@ -0,0 +1,93 @@
+import os
+import uuid
+
+from flask import url_for
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_restful import Resource
+from flask_uploads import extension
+from http import HTTPStatus
+
+from extensions import image_set, image_queue
+from models.image_blob import ImageBlob
+from models.image_job import ImageJob
+from models.recipe import Recipe
+from models.user import User
+from schemas.image_job import ImageJobSchema
+from utils import compress_image_file, image_digest, blob_filename
+
+image_job_schema = ImageJobSchema()
+
+
+# 保存原始图像并提交到进程池压缩 返回202和任务状态
+# 压缩完成后才更新recipe封面或用户图标
+# 已有相同内容的图像时不再压缩 直接完成任务
+def enqueue_image(image, folder, user_id, recipe_id=None):
+    filename = blob_filename(image_digest(image.stream))
+    job = ImageJob(id=str(uuid.uuid4()), user_id=user_id, recipe_id=recipe_id, folder=folder, status='pending')
+    if ImageBlob.acquire(folder, filename):
+        apply_image(job, filename)
+        return image_job_schema.dump(job), HTTPStatus.ACCEPTED, \
+            {'Location': url_for('imagejobresource', job_id=job.id, _external=True)}
+    raw_filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
+    image_set.save(image, folder=folder, name=raw_filename)
+    raw_path = os.path.abspath(image_set.path(filename=raw_filename, folder=folder))
+    job.save()
+    job_id = job.id
+    submitted = image_queue.submit(compress_image_file,
+                                   (raw_path, os.path.abspath(image_set.path(filename=filename, folder=folder))),
+                                   lambda future: finish_image_job(job_id, raw_path, filename, future))
+    if not submitted:
+        os.remove(raw_path)
+        job.delete()
+        return {'message': 'Too many images are being processed, please try again later'}, \
+            HTTPStatus.SERVICE_UNAVAILABLE
+    return image_job_schema.dump(job), HTTPStatus.ACCEPTED, \
+        {'Location': url_for('imagejobresource', job_id=job_id, _external=True)}
+
+
+# 进程池任务完成后执行
+def finish_image_job(job_id, raw_path, filename, future):
+    job = ImageJob.get_by_id(job_id)
+    if future.exception() is not None:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        job.status = 'failed'
+        job.message = 'Not a valid image'
+        job.save()
+        return
+    ImageBlob.add_reference(job.folder, filename)
+    apply_image(job, filename)
+
+
+# 调用前已增加filename的引用 替换recipe封面或用户图标 并释放旧图像的引用
+def apply_image(job, filename):
+    if job.folder == 'recipes':
+        target, attribute = Recipe.get_by_id(recipe_id=job.recipe_id), 'cover_image'
+    else:
+        target, attribute = User.get_by_id(id=job.user_id), 'avatar_image'
+    if target is None:
+        ImageBlob.release(job.folder, filename)
+        job.status = 'failed'
+        job.message = 'Recipe not found'
+        job.save()
+        return
+    old_filename = getattr(target, attribute)
+    if old_filename:
+        ImageBlob.release(job.folder, old_filename)
+    setattr(target, attribute, filename)
+    target.save()
+    job.status = 'done'
+    job.filename = filename
+    job.save()
+
+
+# 查询图像处理状态
+class ImageJobResource(Resource):
+    @jwt_required()
+    def get(self, job_id):
+        job = ImageJob.get_by_id(job_id=job_id)
+        if job is None:
+            return {'message': 'Image job not found'}, HTTPStatus.NOT_FOUND
+        if job.user_id != get_jwt_identity():
+            return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
+        return image_job_schema.dump(job), HTTPStatus.OK
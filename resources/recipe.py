@@ -1,6 +1,4 @@
-import os
-
-from flask import request
+from flask import request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_restful import Resource
 from http import HTTPStatus
@@ -8,11 +6,18 @@ from http import HTTPStatus
 from webargs import fields
 from webargs.flaskparser import use_kwargs
 from marshmallow import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
 
-from extensions import image_set
+from database import use_replica
+from admission import AdmissionRejected
+from extensions import db, image_set, response_cache, image_queue, admission_control
+from models.image_blob import ImageBlob
+from models.pagination import page_size
 from models.recipe import Recipe
-from schemas.recipe import RecipeSchema, RecipePaginationSchema
-from utils import save_image
+from resources.image_job import enqueue_image
+from schemas.recipe import RecipeSchema, RecipePaginationSchema, RecipeCursorPaginationSchema
+from utils import save_image, verify_image_header, request_cache_key, make_etag, page_etag, conditional_headers, \
+    not_modified, iter_ndjson
 
 recipe_schema = RecipeSchema()
 recipe_list_schema = RecipeSchema(many=True)
@@ -20,6 +25,8 @@ recipe_list_schema = RecipeSchema(many=True)
 recipe_cover_schema = RecipeSchema(only=('cover_url', ))
 # 分页schema
 recipe_pagination_schema = RecipePaginationSchema()
+# 游标分页schema
+recipe_cursor_pagination_schema = RecipeCursorPaginationSchema()
 
 
 class RecipeListResource(Resource):
@@ -28,16 +35,53 @@ class RecipeListResource(Resource):
     # https://webargs.readthedocs.io/en/latest/upgrading.html#upgrading-to-6-0
     @use_kwargs({'q': fields.Str(missing=''), 'page': fields.Int(missing=1),
                  'per_page': fields.Int(missing=20),
-                 'sort': fields.Str(missing='created_at'),
-                 'order': fields.Str(missing='desc')}, location="query")
-    def get(self, q, page, per_page, sort, order):
-        # sort和order参数值
-        if sort not in ['created_at', 'cook_time', 'num_of_servings']:
+                 'sort': fields.Str(missing='relevance'),
+                 'order': fields.Str(missing='desc'),
+                 'cursor': fields.Str(missing=None)}, location="query")
+    @use_replica
+    def get(self, q, page, per_page, sort, order, cursor):
+        # sort和order参数值 没有关键字时无法按相关度排序
+        if sort not in ['relevance', 'created_at', 'cook_time', 'num_of_servings'] or \
+                (sort == 'relevance' and not q.strip()):
             sort = 'created_at'
         if order not in ['asc', 'desc']:
             order = 'desc'
-        paginated_recipes = Recipe.get_all_published(q, page, per_page, sort, order)
-        return recipe_pagination_schema.dump(paginated_recipes), HTTPStatus.OK
+        per_page = page_size(per_page)
+        if per_page is None:
+            return {'message': 'per_page must be a positive integer'}, HTTPStatus.BAD_REQUEST
+
+        # 只有缓存未命中时查询数据库 每个客户端在合并之前取得search类别的令牌 合并后的查询占用名额
+        def search():
+            with admission_control.limit('search'):
+                return query()
+
+        def query():
+            # 传入cursor参数(可为空)时使用游标分页 不支持按相关度排序
+            if cursor is not None:
+                try:
+                    paginated_recipes = Recipe.get_all_published(q, page, per_page,
+                                                                 'created_at' if sort == 'relevance' else sort, order,
+                                                                 cursor=cursor)
+                except ValueError:
+                    return None
+                return {'etag': page_etag(paginated_recipes),
+                        'data': recipe_cursor_pagination_schema.dump(paginated_recipes)}
+            paginated_recipes = Recipe.get_all_published(q, page, per_page, sort, order)
+            return {'etag': page_etag(paginated_recipes),
+                    'data': recipe_pagination_schema.dump(paginated_recipes)}
+
+        # 相同参数的请求共用缓存结果 并发的未命中只查询一次
+        try:
+            paginated = response_cache.get_or_set('recipes', request_cache_key(), search,
+                                                  on_miss=lambda: admission_control.throttle('search'))
+        except AdmissionRejected as exc:
+            return exc.response()
+        if paginated is None:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+        headers = conditional_headers(paginated['etag'])
+        if not_modified(paginated['etag']):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        return paginated['data'], HTTPStatus.OK, headers
 
     @jwt_required()
     def post(self):
@@ -55,16 +99,101 @@ class RecipeListResource(Resource):
         return recipe_schema.dump(recipe), HTTPStatus.CREATED
 
 
+# 按id批量获取recipe 请求体{"ids": [1, 2, 3]} 最多RECIPE_BATCH_GET_MAX个
+# 按请求中的顺序返回 每个id的权限判断与RecipeResource.get相同 找不到或无权查看时返回status和message
+class RecipeBatchGetResource(Resource):
+    @jwt_required(optional=True)
+    @use_replica
+    def post(self):
+        json_data = request.get_json(silent=True) or {}
+        recipe_ids = json_data.get('ids') if isinstance(json_data, dict) else None
+        if not isinstance(recipe_ids, list) or not recipe_ids or \
+                not all(type(recipe_id) is int for recipe_id in recipe_ids):
+            return {'message': 'ids must be a non-empty list of integers'}, HTTPStatus.BAD_REQUEST
+        max_ids = current_app.config['RECIPE_BATCH_GET_MAX']
+        if len(recipe_ids) > max_ids:
+            return {'message': 'At most {} ids are allowed'.format(max_ids)}, HTTPStatus.BAD_REQUEST
+        current_user = get_jwt_identity()
+        recipes = Recipe.get_by_ids(recipe_ids)
+        data = []
+        for recipe_id in recipe_ids:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                data.append({'id': recipe_id, 'status': HTTPStatus.NOT_FOUND.value, 'message': 'Recipe not found'})
+            elif recipe.is_publish is False and recipe.user_id != current_user:
+                data.append({'id': recipe_id, 'status': HTTPStatus.FORBIDDEN.value,
+                             'message': 'Access is not allowed'})
+            else:
+                data.append({'id': recipe_id, 'status': HTTPStatus.OK.value, 'recipe': recipe_schema.dump(recipe)})
+        return {'data': data}, HTTPStatus.OK
+
+
+# 批量导入 请求体为NDJSON 每行一个recipe
+# 边读取边校验和插入 内存占用与请求大小无关 导入的recipe未发布
+# 校验失败的行不影响其他行 返回行号和错误信息(最多RECIPE_BULK_MAX_ERRORS条)
+class RecipeBulkResource(Resource):
+    @jwt_required()
+    def post(self):
+        current_user = get_jwt_identity()
+        config = current_app.config
+        result = {'created': 0, 'failed': 0, 'errors': []}
+        batch = []
+        for line_number, data, errors in iter_ndjson(request.stream, config['RECIPE_BULK_MAX_LINE']):
+            if errors is None:
+                try:
+                    data = recipe_schema.load(data=data)
+                except ValidationError as exc:
+                    errors = exc.messages
+            if errors is not None:
+                add_bulk_error(result, line_number, errors, config['RECIPE_BULK_MAX_ERRORS'])
+                continue
+            batch.append((line_number, dict(data, user_id=current_user, is_publish=False)))
+            if len(batch) >= config['RECIPE_BULK_BATCH_SIZE']:
+                import_batch(result, batch, config['RECIPE_BULK_MAX_ERRORS'])
+                batch = []
+        if batch:
+            import_batch(result, batch, config['RECIPE_BULK_MAX_ERRORS'])
+        return result, HTTPStatus.OK
+
+
+def add_bulk_error(result, line_number, errors, max_errors):
+    result['failed'] += 1
+    if len(result['errors']) < max_errors:
+        result['errors'].append({'line': line_number, 'errors': errors})
+
+
+# 一批一个事务 插入失败时整批回滚 每行都记为失败
+def import_batch(result, batch, max_errors):
+    try:
+        Recipe.bulk_insert([row for _, row in batch])
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception('Failed to import recipes')
+        for line_number, _ in batch:
+            add_bulk_error(result, line_number, {'_db': ['Failed to save recipe.']}, max_errors)
+        return
+    result['created'] += len(batch)
+
+
 class RecipeResource(Resource):
+    # 先只查询updated_at等少量列 客户端缓存有效时返回304 不再查询整行和序列化
     @jwt_required(optional=True)
+    @use_replica
     def get(self, recipe_id):
-        recipe = Recipe.get_by_id(recipe_id=recipe_id)
-        if recipe is None:
+        freshness = Recipe.get_freshness(recipe_id=recipe_id)
+        if freshness is None:
             return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
         current_user = get_jwt_identity()
-        if recipe.is_publish is False and recipe.user_id != current_user:
+        if freshness.is_publish is False and freshness.user_id != current_user:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
-        return recipe_schema.dump(recipe), HTTPStatus.OK
+        # 作者信息也在返回内容中
+        etag = make_etag('recipe', freshness.id, freshness.updated_at, freshness.author_updated_at, request.host_url)
+        last_modified = max(filter(None, [freshness.updated_at, freshness.author_updated_at]))
+        headers = conditional_headers(etag, last_modified)
+        if not_modified(etag, last_modified):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        recipe = Recipe.get_by_id(recipe_id=recipe_id)
+        return recipe_schema.dump(recipe), HTTPStatus.OK, headers
 
     @jwt_required(optional=False)
     def patch(self, recipe_id):
@@ -140,6 +269,10 @@ class RecipeCoverUploadResource(Resource):
             return {'message': 'Not a valid image'}, HTTPStatus.BAD_REQUEST
         if not image_set.file_allowed(file, file.filename):
             return {'message': 'File type not allowed'}, HTTPStatus.BAD_REQUEST
+        # 解码前先检查文件头和尺寸
+        error = verify_image_header(file)
+        if error:
+            return {'message': error}, HTTPStatus.BAD_REQUEST
         recipe = Recipe.get_by_id(recipe_id=recipe_id)
         if recipe is None:
             return {'message': 'Recipe not found'}, HTTPStatus.NOT_FOUND
@@ -147,11 +280,13 @@ class RecipeCoverUploadResource(Resource):
         # 用户是否有权修改
         if current_user != recipe.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
-        if recipe.cover_image:
-            cover_path = image_set.path(folder='recipes', filename=recipe.cover_image)
-            if os.path.exists(cover_path):
-                os.remove(cover_path)
+        # 后台压缩 完成后再更新封面
+        if image_queue.enabled:
+            return enqueue_image(image=file, folder='recipes', user_id=current_user, recipe_id=recipe.id)
         filename = save_image(image=file, folder='recipes')
+        # 旧图像不再被引用时由ImageReclaimer删除
+        if recipe.cover_image:
+            ImageBlob.release('recipes', recipe.cover_image)
         recipe.cover_image = filename
         recipe.save()
         return recipe_cover_schema.dump(recipe), HTTPStatus.OK
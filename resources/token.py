@@ -1,3 +1,4 @@
+import time
 from http import HTTPStatus
 from flask import request
 from flask_restful import Resource
@@ -8,12 +9,11 @@ from flask_jwt_extended import (
     jwt_required,
     get_jwt
 )
-from utils import check_password
+from extensions import token_blocklist
+from passwords import PasswordHasherBusy
+from utils import verify_password
 from models.user import User
 
-# 存储注销的访问令牌
-black_list = set()
-
 
 # 令牌 用户可通过令牌访问和检查他们在系统注册的个人信息
 # 即有些信息只有正确用户才能看，其他用户只能看到部分信息
@@ -24,11 +24,22 @@ class TokenResource(Resource):
         email = json_data.get('email')
         password = json_data.get('password')
         user = User.get_by_email(email=email)
-        if user.is_active is False:
+        if user and user.is_active is False:
             return {'message': 'The user account is not activated yet'}, HTTPStatus.FORBIDDEN
-        # check_password将传入密码进行散列化，然后进行比较，非明文比较
-        if not user or not check_password(password, user.password):
+        if not user or not password:
+            return {'message': 'username or password is incorrect'}, HTTPStatus.UNAUTHORIZED
+        # verify_password将传入密码进行散列化，然后进行比较，非明文比较
+        try:
+            valid, new_hash = verify_password(password, user.password)
+        except PasswordHasherBusy:
+            return {'message': 'Server busy, please try again later'}, HTTPStatus.SERVICE_UNAVAILABLE, \
+                {'Retry-After': '1'}
+        if not valid:
             return {'message': 'username or password is incorrect'}, HTTPStatus.UNAUTHORIZED
+        # 散列参数已过时 使用本次登录的明文密码升级
+        if new_hash is not None:
+            user.password = new_hash
+            user.save()
         # fresh=True
         access_token = create_access_token(identity=user.id, fresh=True)
         # 创建刷新令牌
@@ -50,7 +61,7 @@ class RevokeResource(Resource):
     @jwt_required()
     def post(self):
         # 得到访问令牌(有效载荷payload)
-        jti = get_jwt()['jti']
-        # 加入黑名单
-        black_list.add(jti)
+        payload = get_jwt()
+        # 加入黑名单 到期后自动移除
+        token_blocklist.add(payload['jti'], payload.get('exp', time.time() + 365 * 24 * 3600))
         return {'message': 'Successfully logged out'}, HTTPStatus.OK
@@ -1,6 +1,8 @@
-import os
+import csv
+import io
+import json
 
-from flask import request, url_for, render_template
+from flask import request, url_for, render_template, Response, stream_with_context
 # https://flask-jwt-extended.readthedocs.io/en/stable/v4_upgrade_guide/ 版本变化
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from flask_restful import Resource
@@ -10,29 +12,36 @@ from marshmallow import ValidationError
 from webargs import fields
 from webargs.flaskparser import use_kwargs
 
-from extensions import image_set
-from mailgun import MailgunApi
+from database import use_replica
+from extensions import image_set, image_queue, outbox_sender
+from loaders import prime_authors
+from models.image_blob import ImageBlob
+from models.outbox import OutboxEmail
+from passwords import PasswordHasherBusy
 from models.recipe import Recipe
-from schemas.recipe import RecipeSchema, RecipePaginationSchema
+from models.pagination import page_size
+from schemas.recipe import RecipeSchema, RecipePaginationSchema, RecipeCursorPaginationSchema
 from schemas.user import UserSchema
 from models.user import User
+from resources.image_job import enqueue_image
 
 
 # schema.dump().data --》 data弃用 直接使用schema.dump()返回数据
-from utils import generate_token, verify_token, save_image
+from utils import generate_token, verify_token, save_image, verify_image_header, make_etag, page_etag, \
+    conditional_headers, not_modified
 
 user_schema = UserSchema()
-# 排除邮箱 未经过验证或正在访问其他人的url端点时 隐藏电子邮件
-user_public_schema = UserSchema(exclude=('email', ))
+# 排除邮箱 未经过验证或正在访问其他人的url端点时 隐藏电子邮件和未发布的recipe数
+user_public_schema = UserSchema(exclude=('email', 'private_recipe_count', 'recipe_count'))
 # 一个用户存在多个recipe
 recipe_list_schema = RecipeSchema(many=True)
-# mailgun对象
-mailgun = MailgunApi(domain=os.environ.get('MAILGUN_DOMAIN'),
-                     api_key=os.environ.get('MAILGUN_API_KEY'))
 # 用户图标schema 只显示avatar_url
 user_avatar_schema = UserSchema(only=('avatar_url', ))
 # 分页所展示的schema
 recipe_pagination_schema = RecipePaginationSchema()
+recipe_cursor_pagination_schema = RecipeCursorPaginationSchema()
+# 导出时不重复输出作者 不输出各尺寸图片的url(字典 无法写入CSV的一列)
+recipe_export_schema = RecipeSchema(exclude=('author', 'cover_srcset'))
 
 
 class UserListResource(Resource):
@@ -44,6 +53,9 @@ class UserListResource(Resource):
             data = user_schema.load(data=json_data)
         except ValidationError as exc:
             return {'message': "Validation errors", 'errors': exc.messages}, HTTPStatus.BAD_REQUEST
+        except PasswordHasherBusy:
+            return {'message': 'Server busy, please try again later'}, HTTPStatus.SERVICE_UNAVAILABLE, \
+                {'Retry-After': '1'}
         # 用户名或邮箱存在
         if User.get_by_username(data.get('username')):
             return {'message': 'username already used'}, HTTPStatus.BAD_REQUEST
@@ -57,47 +69,77 @@ class UserListResource(Resource):
         link = url_for('useractivateresource',
                        token=token,
                        _external=True)
-        text = 'Hi, Thanks for using SmileCook! Please confirm your registration by clicking on the link: {}'.format(link)
-        # 发送激活邮件
-        mailgun.send_email(to=user.email,
-                           subject=subject,
-                           text=text,
-                           html=render_template('email/confirmation.html', link=link))
+        # 正文中的链接使用收件人变量 内容相同的邮件可以合并为一次Mailgun请求
+        text = 'Hi, Thanks for using SmileCook! Please confirm your registration by clicking on the link: ' \
+               '%recipient.link%'
+        # 激活邮件写入outbox 与用户在同一事务中提交 由后台线程发送 不阻塞请求
+        OutboxEmail.add(recipient=user.email,
+                        subject=subject,
+                        text=text,
+                        html=render_template('email/confirmation.html', link='%recipient.link%'),
+                        variables={'link': link})
         user.save()
+        outbox_sender.wake()
         # dump 序列化
         return user_schema.dump(user), HTTPStatus.CREATED
 
 
 class UserResource(Resource):
     # token参数可选
+    # 客户端缓存有效时返回304 不再查询整行和序列化
     @jwt_required(optional=True)
+    @use_replica
     def get(self, username):
-        user = User.get_by_username(username=username)
-        if user is None:
+        freshness = User.get_freshness_by_username(username=username)
+        if freshness is None:
             return {'message': 'user not found'}, HTTPStatus.NOT_FOUND
         # 根据token得到用户id
         current_user = get_jwt_identity()
-        if current_user == user.id:
+        # 本人可以看到邮箱 与他人看到的内容不同
+        is_owner = current_user == freshness.id
+        # recipe计数变化时updated_at不变 不使用Last-Modified 只按ETag判断
+        etag = make_etag('user', freshness.id, freshness.updated_at, freshness.published_recipe_count,
+                         freshness.private_recipe_count if is_owner else None, is_owner, request.host_url)
+        headers = conditional_headers(etag)
+        if not_modified(etag):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        user = User.get_by_id(id=freshness.id)
+        if is_owner:
             data = user_schema.dump(user)
         else:
             data = user_public_schema.dump(user)
-        return data, HTTPStatus.OK
+        return data, HTTPStatus.OK, headers
 
 
 # 仅通过令牌token就可以访问用户信息，url中不需要其他信息
 class MeResource(Resource):
     @jwt_required()
+    @use_replica
     def get(self):
-        user = User.get_by_id(id=get_jwt_identity())
-        return user_schema.dump(user), HTTPStatus.OK
+        freshness = User.get_freshness_by_id(id=get_jwt_identity())
+        # 令牌有效但用户已被删除
+        if freshness is None:
+            return {'message': 'user not found'}, HTTPStatus.NOT_FOUND
+        etag = make_etag('user', freshness.id, freshness.updated_at, freshness.published_recipe_count,
+                         freshness.private_recipe_count, True, request.host_url)
+        headers = conditional_headers(etag)
+        if not_modified(etag):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        user = User.get_by_id(id=freshness.id)
+        return user_schema.dump(user), HTTPStatus.OK, headers
 
 
 # 获取特定用户的recipes
 class UserRecipeListResource(Resource):
     @jwt_required(optional=True)
     #  location="query" 对请求值进行加载
-    @use_kwargs({'page': fields.Int(missing=1), 'per_page': fields.Int(missing=10), 'visibility': fields.Str(missing='public')}, location="query")
-    def get(self, username, page, per_page, visibility):
+    @use_kwargs({'page': fields.Int(missing=1), 'per_page': fields.Int(missing=10), 'visibility': fields.Str(missing='public'),
+                 'cursor': fields.Str(missing=None)}, location="query")
+    @use_replica
+    def get(self, username, page, per_page, visibility, cursor):
+        per_page = page_size(per_page)
+        if per_page is None:
+            return {'message': 'per_page must be a positive integer'}, HTTPStatus.BAD_REQUEST
         user = User.get_by_username(username=username)
         if user is None:
             return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
@@ -106,8 +148,73 @@ class UserRecipeListResource(Resource):
             pass
         else:
             visibility = 'public'
-        paginated_recipes = Recipe.get_all_by_user(user_id=user.id, page=page, per_page=per_page, visibility=visibility)
-        return recipe_pagination_schema.dump(paginated_recipes), HTTPStatus.OK
+        # 该用户即为所有recipe的作者 无需再次查询
+        prime_authors(user)
+        # 游标分页
+        if cursor is not None:
+            try:
+                paginated_recipes = Recipe.get_all_by_user(user_id=user.id, page=page, per_page=per_page,
+                                                           visibility=visibility, cursor=cursor)
+            except ValueError:
+                return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+            schema = recipe_cursor_pagination_schema
+        else:
+            paginated_recipes = Recipe.get_all_by_user(user_id=user.id, page=page, per_page=per_page,
+                                                       visibility=visibility,
+                                                       total=user.get_recipe_count(visibility))
+            schema = recipe_pagination_schema
+        # 分页结果未变化时返回304 不进行序列化
+        etag = page_etag(paginated_recipes)
+        headers = conditional_headers(etag)
+        if not_modified(etag):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        return schema.dump(paginated_recipes), HTTPStatus.OK, headers
+
+
+# 导出用户的全部recipe 逐行序列化并以NDJSON或CSV流式返回 内存占用与recipe数量无关
+# 可见性规则与UserRecipeListResource相同
+class UserRecipeExportResource(Resource):
+    @jwt_required(optional=True)
+    @use_kwargs({'format': fields.Str(missing='ndjson'), 'visibility': fields.Str(missing='public')},
+                location="query")
+    @use_replica
+    def get(self, username, format, visibility):
+        if format not in ['ndjson', 'csv']:
+            return {'message': 'format must be ndjson or csv'}, HTTPStatus.BAD_REQUEST
+        user = User.get_by_username(username=username)
+        if user is None:
+            return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
+        current_user = get_jwt_identity()
+        if current_user != user.id or visibility not in ['all', 'private']:
+            visibility = 'public'
+        recipes = Recipe.iter_by_user(user_id=user.id, visibility=visibility)
+        if format == 'csv':
+            rows, mimetype = export_csv(recipes), 'text/csv'
+        else:
+            rows, mimetype = export_ndjson(recipes), 'application/x-ndjson'
+        headers = {'Content-Disposition': 'attachment; filename="{}-recipes.{}"'.format(username, format)}
+        # 生成器在返回响应后才执行 需要保留请求上下文(url_for和数据库session)
+        return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
+
+
+def export_ndjson(recipes):
+    for recipe in recipes:
+        yield json.dumps(recipe_export_schema.dump(recipe)) + '\n'
+
+
+def export_csv(recipes):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(values)
+        return buffer.getvalue()
+
+    yield line(recipe_export_schema.fields)
+    for recipe in recipes:
+        yield line(recipe_export_schema.dump(recipe).values())
 
 
 # 用户激活resource
@@ -138,12 +245,18 @@ class UserAvatarUploadResource(Resource):
             return {'message': 'Not a valid image'}, HTTPStatus.BAD_REQUEST
         if not image_set.file_allowed(file, file.filename):
             return {'message': 'File type not allowed'}, HTTPStatus.BAD_REQUEST
+        # 解码前先检查文件头和尺寸
+        error = verify_image_header(file)
+        if error:
+            return {'message': error}, HTTPStatus.BAD_REQUEST
         user = User.get_by_id(id=get_jwt_identity())
-        if user.avatar_image:
-            avatar_path = image_set.path(folder='avatars', filename=user.avatar_image)
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
+        # 后台压缩 完成后再更新图标
+        if image_queue.enabled:
+            return enqueue_image(image=file, folder='avatars', user_id=user.id)
         filename = save_image(image=file, folder='avatars')
+        # 旧图像不再被引用时由ImageReclaimer删除
+        if user.avatar_image:
+            ImageBlob.release('avatars', user.avatar_image)
         user.avatar_image = filename
         user.save()
         return user_avatar_schema.dump(user), HTTPStatus.OK
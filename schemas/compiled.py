@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+
+from marshmallow import Schema, fields
+from marshmallow.utils import ensure_text_type
+
+from profiling import timed
+
+
+# 根据schema的字段定义生成专用的序列化函数 输出与marshmallow的dump()相同
+# 省去每个对象每个字段的get_value/serialize调度 嵌套schema同样编译
+# 带默认值或按路径取值('a.b')的字段无法编译 此时整个schema使用marshmallow原来的dump()
+# 定义了pre_dump/post_dump的schema不编译 使用marshmallow原来的dump()
+# dict等映射对象不能通过属性访问 使用marshmallow原来的dump()
+class CompiledSchema(Schema):
+    def dump(self, obj, *, many=None):
+        with timed('dump'):
+            return self._dump(obj, many=many)
+
+    def _dump(self, obj, *, many=None):
+        many = self.many if many is None else bool(many)
+        serializer = self._get_compiled()
+        if serializer is None or obj is None:
+            return super().dump(obj, many=many)
+        if many:
+            items = obj if isinstance(obj, list) else list(obj)
+            # dict等不能通过属性访问的对象
+            if any(issubclass(item_type, Mapping) for item_type in {type(item) for item in items}):
+                return super().dump(items, many=True)
+            return [serializer(item) for item in items]
+        if isinstance(obj, Mapping):
+            return super().dump(obj, many=False)
+        return serializer(obj)
+
+    def _get_compiled(self):
+        try:
+            return self.__dict__['_compiled']
+        except KeyError:
+            pass
+        if self._has_processors('pre_dump') or self._has_processors('post_dump'):
+            serializer = None
+        else:
+            serializer = compile_dump(self)
+        self.__dict__['_compiled'] = serializer
+        return serializer
+
+
+class NotCompilable(Exception):
+    pass
+
+
+# 返回None表示有字段无法编译
+def compile_dump(schema):
+    namespace = {'_text': ensure_text_type}
+    lines = ['def dump(obj):']
+    items = []
+    try:
+        for index, (name, field) in enumerate(schema.dump_fields.items()):
+            key = field.data_key if field.data_key is not None else name
+            items.append('{!r}: {}'.format(key, compile_field(field, name, index, namespace, lines)))
+    except NotCompilable:
+        return None
+    lines.append('    return {{{}}}'.format(', '.join(items)))
+    exec('\n'.join(lines), namespace)
+    return namespace['dump']
+
+
+# 在lines中添加取值语句 返回序列化后的表达式
+def compile_field(field, name, index, namespace, lines):
+    field_type = type(field)
+    if field_type is fields.Method and field.serialize_method_name:
+        method = '_method{}'.format(index)
+        namespace[method] = getattr(field.parent, field.serialize_method_name)
+        return '{}(obj)'.format(method)
+
+    # 只编译直接读取属性且没有默认值的字段
+    attribute = field.attribute or name
+    if not field._CHECK_ATTRIBUTE or not attribute.isidentifier() or field.dump_default is not fields.missing_:
+        raise NotCompilable(name)
+
+    value = 'v{}'.format(index)
+    lines.append('    {} = obj.{}'.format(value, attribute))
+    if field_type is fields.Integer and not field.as_string:
+        return 'None if {0} is None else int({0})'.format(value)
+    if field_type in (fields.String, fields.Email):
+        return '{0} if {0}.__class__ is str or {0} is None else _text({0})'.format(value)
+    if field_type is fields.Boolean:
+        serialize = '_field{}'.format(index)
+        namespace[serialize] = field._serialize
+        return '{0} if {0}.__class__ is bool or {0} is None else {1}({0}, None, None)'.format(value, serialize)
+    if field_type is fields.DateTime:
+        data_format = field.format or field.DEFAULT_FORMAT
+        formatter = '_format{}'.format(index)
+        namespace[formatter] = field.SERIALIZATION_FUNCS.get(data_format) or (lambda dt: dt.strftime(data_format))
+        return 'None if {0} is None else {1}({0})'.format(value, formatter)
+    if field_type is fields.Nested and isinstance(field.schema, CompiledSchema):
+        nested = '_nested{}'.format(index)
+        nested_schema = field.schema
+        many = nested_schema.many or field.many
+        nested_serializer = nested_schema._get_compiled()
+        # 单个对象且可以编译时直接调用编译后的函数 不经过dump()(计时和dict判断)
+        if many or nested_serializer is None:
+            namespace[nested] = lambda obj: nested_schema.dump(obj, many=many)
+        else:
+            namespace['_Mapping'] = Mapping
+            namespace['_dump{}'.format(index)] = nested_schema.dump
+            namespace[nested] = nested_serializer
+            return 'None if {0} is None else _dump{2}({0}) if isinstance({0}, _Mapping) else {1}({0})'.format(
+                value, nested, index)
+        return 'None if {0} is None else {1}({0})'.format(value, nested)
+    # 其他字段类型 调用field._serialize
+    serialize = '_field{}'.format(index)
+    namespace[serialize] = field._serialize
+    return '{}({}, {!r}, obj)'.format(serialize, value, name)
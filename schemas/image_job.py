@@ -0,0 +1,21 @@
+from marshmallow import Schema, fields
+
+from extensions import media_urls
+
+
+# url: 处理完成后图像的地址
+class ImageJobSchema(Schema):
+    class Meta:
+        ordered = True
+    id = fields.String(dump_only=True)
+    status = fields.String(dump_only=True)
+    url = fields.Method(serialize='dump_url')
+    message = fields.String(dump_only=True)
+    created_at = fields.DateTime(dump_only=True)
+    updated_at = fields.DateTime(dump_only=True)
+
+    @staticmethod
+    def dump_url(job):
+        if job.status == 'done':
+            return media_urls.image_url(job.folder, job.filename)
+        return None
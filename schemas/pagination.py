@@ -44,3 +44,32 @@ class PaginationSchema(Schema):
             pagination_links['next'] = self.get_url(page=paginated_objects.next_num)
         return pagination_links
 
+
+# 游标分页 不返回page/pages/total_count
+# first: The link to the first page
+# prev: The link to the previous page
+# next: The link to the next page
+# per_page: The number of records per page
+class CursorPaginationSchema(Schema):
+    class Meta:
+        ordered = True
+    links = fields.Method(serialize='get_cursor_links')
+    per_page = fields.Integer(dump_only=True)
+
+    # 根据cursor生成页面url 替换request中的page参数
+    @staticmethod
+    def get_url(cursor):
+        query_args = request.args.to_dict()
+        query_args.pop('page', None)
+        query_args['cursor'] = cursor
+        return '{}?{}'.format(request.base_url, urlencode(query_args))
+
+    def get_cursor_links(self, paginated_objects):
+        pagination_links = {
+            'first': self.get_url(cursor='')
+        }
+        if paginated_objects.has_prev:
+            pagination_links['prev'] = self.get_url(cursor=paginated_objects.prev_cursor)
+        if paginated_objects.has_next:
+            pagination_links['next'] = self.get_url(cursor=paginated_objects.next_cursor)
+        return pagination_links
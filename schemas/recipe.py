@@ -1,7 +1,8 @@
-from flask import url_for
-from marshmallow import Schema, fields, validate, ValidationError, validates, post_dump
+from marshmallow import fields, validate, ValidationError, validates, post_dump
 
-from schemas.pagination import PaginationSchema
+from extensions import media_urls
+from schemas.compiled import CompiledSchema
+from schemas.pagination import PaginationSchema, CursorPaginationSchema
 from schemas.user import UserSchema
 
 
@@ -23,7 +24,7 @@ def validate_num_of_servings(n):
 # author: This attribute is used to display the author of the recipe.
 # created_at: Use fields.DateTime to represent the format of the time, and dump_only=True means that this attribute is only available for serialization.
 # updated_at: Use fields.DateTime to represent the format of the time, and dump_only=True means that this attribute is only available for serialization.
-class RecipeSchema(Schema):
+class RecipeSchema(CompiledSchema):
     class Meta:
         ordered = True
     id = fields.Integer(dump_only=True)
@@ -35,19 +36,26 @@ class RecipeSchema(Schema):
     cook_time = fields.Integer()
     is_publish = fields.Boolean(dump_only=True)
     # 嵌入一个属性 从UserSchema中除了邮件全部展示
-    author = fields.Nested(UserSchema(exclude=('email', )), attribute='user', dump_only=True)
+    # recipe计数不在作者信息中返回 计数变化时不影响recipe列表缓存
+    author = fields.Nested(UserSchema(exclude=('email', 'published_recipe_count', 'private_recipe_count',
+                                              'recipe_count')), attribute='user', dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
     # 图像url
     cover_url = fields.Method(serialize='dump_cover_url')
+    # 各宽度的缩略图url {'320w': url?w=320, ...}
+    cover_srcset = fields.Method(serialize='dump_cover_srcset')
 
     # 序列化图像url
     @staticmethod
     def dump_cover_url(recipe):
         if recipe.cover_image:
-            return url_for('static', filename='images/recipes/{}'.format(recipe.cover_image), _external=True)
+            return media_urls.image_url('recipes', recipe.cover_image)
         else:
-            return url_for('static', filename='images/assets/default-recipe-cover.jpg', _external=True)
+            return media_urls.asset_url('default-recipe-cover.jpg')
+
+    def dump_cover_srcset(self, recipe):
+        return media_urls.srcset(self.dump_cover_url(recipe))
 
     # 判断cook_time的有效性
     @validates('cook_time')
@@ -63,6 +71,5 @@ class RecipePaginationSchema(PaginationSchema):
     data = fields.Nested(RecipeSchema, attribute='items', many=True)
 
 
-
-
-
+class RecipeCursorPaginationSchema(CursorPaginationSchema):
+    data = fields.Nested(RecipeSchema, attribute='items', many=True)
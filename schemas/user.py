@@ -1,5 +1,7 @@
-from flask import url_for
-from marshmallow import Schema, fields
+from marshmallow import fields
+
+from extensions import media_urls
+from schemas.compiled import CompiledSchema
 from utils import hash_password
 
 
@@ -9,7 +11,7 @@ from utils import hash_password
 # password:fields.Method() is a Method field. The Method field here receives an optional deserialize argument, which defines how the field should be deserialized. We use deserialize='load_password' to indicate that the load_password(self, value) method will be invoked when using load() deserialization. Please note that this load_password(self, value) method will only be invoked during load() deserialization.
 # created_at:fields.DateTime() represents the time format, and dump_only=True means that this property will only be available in serialization.
 # updated_at:fields.DateTime() represents the time format, and dump_only=True means that this property will only be available in serialization.
-class UserSchema(Schema):
+class UserSchema(CompiledSchema):
     class Meta:
         ordered = True
     id = fields.Int(dump_only=True)
@@ -19,6 +21,9 @@ class UserSchema(Schema):
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
     avatar_url = fields.Method(serialize='dump_avatar_url')
+    published_recipe_count = fields.Int(dump_only=True)
+    private_recipe_count = fields.Int(dump_only=True)
+    recipe_count = fields.Int(dump_only=True)
 
     @staticmethod
     def load_password(value):
@@ -26,8 +31,8 @@ class UserSchema(Schema):
 
     @staticmethod
     def dump_avatar_url(user):
-        # _external 绝对url 这样图片会存储在server中 而非本地
+        # 绝对url 基础地址只计算一次 见media.py
         if user.avatar_image:
-            return url_for('static', filename='images/avatars/{}'.format(user.avatar_image), _external=True)
+            return media_urls.image_url('avatars', user.avatar_image)
         else:
-            return url_for('static', filename='images/assets/default-avatar.jpg', _external=True)
+            return media_urls.asset_url('default-avatar.jpg')
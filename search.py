@@ -0,0 +1,128 @@
+from sqlalchemy import DDL, event, or_, desc, text, literal_column, table, column, func
+
+from extensions import db
+
+# 全文检索
+# PostgreSQL: recipe.search_vector (tsvector) + GIN索引
+# SQLite: FTS5虚拟表 recipe_fts, rowid与recipe.id一致
+# 其他数据库退回原来的ilike '%q%'
+SEARCH_LANGUAGE = 'english'
+
+# name权重最高 其次description 最后ingredients
+PG_SEARCH_VECTOR = "setweight(to_tsvector('{lang}', coalesce(name, '')), 'A') || " \
+                   "setweight(to_tsvector('{lang}', coalesce(description, '')), 'B') || " \
+                   "setweight(to_tsvector('{lang}', coalesce(ingredients, '')), 'C')".format(lang=SEARCH_LANGUAGE)
+
+
+class IlikeRecipeSearch:
+    # 无法使用索引 全表扫描
+    def match(self, model, query, q):
+        keyword = '%{keyword}%'.format(keyword=q)
+        query = query.filter(or_(model.name.ilike(keyword),
+                                 model.description.ilike(keyword),
+                                 model.ingredients.ilike(keyword)))
+        return query, desc(model.created_at)
+
+    def index(self, recipe):
+        pass
+
+    def remove(self, recipe):
+        pass
+
+    def index_new(self, after_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class PostgresRecipeSearch:
+    vector = literal_column('recipe.search_vector')
+
+    def match(self, model, query, q):
+        ts_query = func.plainto_tsquery(SEARCH_LANGUAGE, q)
+        query = query.filter(self.vector.op('@@')(ts_query))
+        return query, desc(func.ts_rank_cd(self.vector, ts_query))
+
+    # 在保存recipe的同一事务中更新search_vector
+    def index(self, recipe):
+        db.session.execute(text('UPDATE recipe SET search_vector = {} WHERE id = :id'.format(PG_SEARCH_VECTOR)),
+                           {'id': recipe.id})
+
+    # 删除行时search_vector随之删除
+    def remove(self, recipe):
+        pass
+
+    # 批量插入后 更新id大于after_id且尚未建立索引的行
+    def index_new(self, after_id):
+        db.session.execute(text('UPDATE recipe SET search_vector = {} '
+                                'WHERE id > :after_id AND search_vector IS NULL'.format(PG_SEARCH_VECTOR)),
+                           {'after_id': after_id})
+
+    def rebuild(self):
+        db.session.execute(text('UPDATE recipe SET search_vector = {}'.format(PG_SEARCH_VECTOR)))
+
+
+class SqliteRecipeSearch:
+    fts = table('recipe_fts', column('rowid'), column('rank'))
+
+    # FTS5查询语法中的特殊字符按普通词处理
+    @staticmethod
+    def to_match_expression(q):
+        return ' '.join('"{}"'.format(term.replace('"', '""')) for term in q.split())
+
+    def match(self, model, query, q):
+        query = query.join(self.fts, self.fts.c.rowid == model.id). \
+            filter(literal_column('recipe_fts').op('MATCH')(self.to_match_expression(q)))
+        # bm25 越小越相关
+        return query, self.fts.c.rank.asc()
+
+    def index(self, recipe):
+        self.remove(recipe)
+        db.session.execute(text('INSERT INTO recipe_fts (rowid, name, description, ingredients) '
+                                'VALUES (:id, :name, :description, :ingredients)'),
+                           {'id': recipe.id,
+                            'name': recipe.name,
+                            'description': recipe.description,
+                            'ingredients': recipe.ingredients})
+
+    def remove(self, recipe):
+        db.session.execute(text('DELETE FROM recipe_fts WHERE rowid = :id'), {'id': recipe.id})
+
+    def index_new(self, after_id):
+        db.session.execute(text('INSERT INTO recipe_fts (rowid, name, description, ingredients) '
+                                'SELECT id, name, description, ingredients FROM recipe WHERE id > :after_id '
+                                'AND id NOT IN (SELECT rowid FROM recipe_fts WHERE rowid > :after_id)'),
+                           {'after_id': after_id})
+
+    def rebuild(self):
+        db.session.execute(text('DELETE FROM recipe_fts'))
+        db.session.execute(text('INSERT INTO recipe_fts (rowid, name, description, ingredients) '
+                                'SELECT id, name, description, ingredients FROM recipe'))
+
+
+search_backends = {
+    'postgresql': PostgresRecipeSearch(),
+    'sqlite': SqliteRecipeSearch(),
+}
+ilike_search = IlikeRecipeSearch()
+
+
+# 根据当前数据库选择检索方式
+def recipe_search():
+    return search_backends.get(db.engine.dialect.name, ilike_search)
+
+
+# db.create_all()创建recipe表后 同时创建检索所需的列/虚拟表
+# 已有数据库通过migrations升级
+def register_search_ddl(recipe_table):
+    event.listen(recipe_table, 'after_create',
+                 DDL('ALTER TABLE recipe ADD COLUMN search_vector tsvector').execute_if(dialect='postgresql'))
+    event.listen(recipe_table, 'after_create',
+                 DDL('CREATE INDEX ix_recipe_search_vector ON recipe USING gin (search_vector)')
+                 .execute_if(dialect='postgresql'))
+    event.listen(recipe_table, 'after_create',
+                 DDL('CREATE VIRTUAL TABLE recipe_fts USING fts5(name, description, ingredients)')
+                 .execute_if(dialect='sqlite'))
+    event.listen(recipe_table, 'before_drop',
+                 DDL('DROP TABLE IF EXISTS recipe_fts').execute_if(dialect='sqlite'))
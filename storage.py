@@ -0,0 +1,65 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+
+# 后台删除不再被引用的图像文件(image_blob.refcount为0)
+# 引用归零后保留IMAGE_RECLAIM_GRACE秒 期间相同内容的上传可以直接重新引用
+class ImageReclaimer:
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_RECLAIM_ENABLED', True)
+        app.config.setdefault('IMAGE_RECLAIM_INTERVAL', 600)
+        app.config.setdefault('IMAGE_RECLAIM_GRACE', 3600)
+        app.config.setdefault('IMAGE_RECLAIM_BATCH_SIZE', 500)
+        self.app = app
+        app.extensions['image_reclaimer'] = self
+        if app.config['IMAGE_RECLAIM_ENABLED']:
+            app.before_request(self.start)
+
+    # 第一个请求时启动后台线程
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='image-reclaimer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.app.config['IMAGE_RECLAIM_INTERVAL']):
+            try:
+                with self.app.app_context():
+                    self.reclaim()
+            except Exception:
+                self.app.logger.exception('Failed to reclaim images')
+
+    # 返回删除的文件数
+    # 先删除文件再提交 提交前其他请求增加引用时会等待(行锁) 之后找不到记录而重新写入文件
+    def reclaim(self):
+        from extensions import db, image_set
+        from models.image_blob import ImageBlob
+
+        released_before = datetime.utcnow() - timedelta(seconds=self.app.config['IMAGE_RECLAIM_GRACE'])
+        reclaimed = 0
+        while True:
+            blobs = ImageBlob.get_unreferenced(released_before, limit=self.app.config['IMAGE_RECLAIM_BATCH_SIZE'])
+            if not blobs:
+                db.session.commit()
+                return reclaimed
+            for folder, filename in [(blob.folder, blob.filename) for blob in blobs]:
+                if not ImageBlob.delete_unreferenced(folder, filename, released_before):
+                    continue
+                try:
+                    os.remove(image_set.path(filename=filename, folder=folder))
+                except FileNotFoundError:
+                    pass
+                reclaimed += 1
+            db.session.commit()
@@ -1,24 +1,37 @@
+import hashlib
+import json
 import os
+import tempfile
 import uuid
+from datetime import timezone
+from urllib.parse import urlencode
 
 from PIL import Image
 from flask_uploads import extension
-from passlib.hash import pbkdf2_sha256
 from itsdangerous import URLSafeTimedSerializer
-from flask import current_app
+from werkzeug.http import http_date
+from flask import current_app, request, Request
 
 
 # 加密
-from extensions import image_set
+from extensions import image_set, password_hasher
+from models.image_blob import ImageBlob
+from profiling import timed
 
 
+# 在进程池中计算 rounds由PASSWORD_HASH_ROUNDS配置或根据目标耗时测量
 def hash_password(password):
-    return pbkdf2_sha256.hash(password)
+    return password_hasher.hash(password)
 
 
 # 检查密码正确性
 def check_password(password, hashed):
-    return pbkdf2_sha256.verify(password, hashed)
+    return password_hasher.verify_and_update(password, hashed)[0]
+
+
+# 返回 (是否正确, 新散列)，散列参数已过时(rounds低于当前配置)时返回升级后的散列 否则为None
+def verify_password(password, hashed):
+    return password_hasher.verify_and_update(password, hashed)
 
 
 # salt用于区分不同令牌 例如创建 重置密码 升级账户等
@@ -38,32 +51,79 @@ def verify_token(token, max_age=(30 * 60), salt=None):
     return email
 
 
-# uuid生成文件名
+# 按上传内容的hash命名 见blob_filename
 # 保存目的地是static/images。如果我们folder="avatar"作为参数传入，目标图像将会存储在static/images/avatar
 # 保存目的地在config.py中配置
+# 已有相同内容的图像时只增加引用 不再保存和压缩 引用与图像字段的修改一起提交
 def save_image(image, folder):
-    filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
-    image_set.save(image, folder=folder, name=filename)
-    filename = compress_image(filename=filename, folder=folder)
+    filename = blob_filename(image_digest(image.stream))
+    with timed('image'):
+        if ImageBlob.acquire(folder, filename):
+            return filename
+        raw_filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
+        image_set.save(image, folder=folder, name=raw_filename)
+        compress_image_file(image_set.path(filename=raw_filename, folder=folder),
+                            image_set.path(filename=filename, folder=folder))
+        ImageBlob.add_reference(folder, filename)
     return filename
 
 
-# 压缩图像
-def compress_image(filename, folder):
-    file_path = image_set.path(filename=filename, folder=folder)
-    # 创建图像对象
-    image = Image.open(file_path)
-    if image.mode != "RGB":
-        image = image.convert("RGB")
-    # 使图像宽高小于1600像素 同时保持横纵比不变
-    if max(image.width, image.height) > 1600:
-        maxsize = (1600, 1600)
-        image.thumbnail(maxsize)
+# 上传内容的sha256 按块读取
+def image_digest(stream):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+# 按hash前缀分两级子目录 每个目录中的文件数有限
+def blob_filename(digest):
+    return '{}/{}/{}.jpg'.format(digest[:2], digest[2:4], digest)
+
 
-    compressed_filename = '{}.jpg'.format(uuid.uuid4())
-    compressed_file_path = image_set.path(filename=compressed_filename, folder=folder)
-    # quality 大于95几乎没优化
-    image.save(compressed_file_path, optimize=True, quality=85)
+# 上传的文件在解析表单时按块直接写入磁盘临时文件 不在内存中缓存
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.TemporaryFile('wb+')
+
+
+# 只读取文件头 检查是否为图像以及像素数 不解码整张图像
+# 返回错误信息 检查通过时返回None
+def verify_image_header(image):
+    try:
+        with Image.open(image.stream) as header:
+            width, height = header.size
+    except (OSError, Image.DecompressionBombError):
+        return 'Not a valid image'
+    finally:
+        image.stream.seek(0)
+    if width * height > current_app.config['IMAGE_MAX_PIXELS']:
+        return 'Image dimensions are too large'
+    return None
+
+
+# 压缩图像文件并删除原始图像 不依赖flask 可在进程池中执行
+# 先写入临时文件再重命名 同时压缩相同内容的图像时不会读到写了一半的文件
+def compress_image_file(file_path, compressed_file_path, max_size=1600):
+    os.makedirs(os.path.dirname(compressed_file_path), exist_ok=True)
+    temp_path = '{}.{}.tmp'.format(compressed_file_path, uuid.uuid4().hex)
+    # 创建图像对象 此时只读取了文件头
+    with Image.open(file_path) as image:
+        # JPEG在解码时直接按1/2、1/4、1/8缩小到不小于目标尺寸 不解码完整分辨率的位图
+        if image.format == 'JPEG' and max(image.width, image.height) > max_size:
+            scale = max_size / max(image.width, image.height)
+            image.draft('RGB', (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # 使图像宽高小于1600像素 同时保持横纵比不变
+        if max(image.width, image.height) > max_size:
+            maxsize = (max_size, max_size)
+            image.thumbnail(maxsize)
+
+        # quality 大于95几乎没优化
+        image.save(temp_path, 'JPEG', optimize=True, quality=85)
+    os.replace(temp_path, compressed_file_path)
 
     original_size = os.stat(file_path).st_size
     compressed_size = os.stat(compressed_file_path).st_size
@@ -72,4 +132,61 @@ def compress_image(filename, folder):
     print("The file size is reduced by {}%, from {} to {}.".format(percentage, original_size, compressed_size))
     # 删除原始图像
     os.remove(file_path)
-    return compressed_filename
+
+
+# 响应缓存的key 与查询参数的顺序无关
+def request_cache_key():
+    return '{}?{}'.format(request.base_url, urlencode(sorted(request.args.items(multi=True))))
+
+
+# 由资源的版本信息(id、updated_at等)生成强ETag
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+# 分页结果的指纹 由每条recipe及其作者的updated_at和分页信息组成
+def page_etag(paginated_objects):
+    parts = [request_cache_key(), getattr(paginated_objects, 'total', None),
+             paginated_objects.has_prev, paginated_objects.has_next]
+    for item in paginated_objects.items:
+        parts += [item.id, item.updated_at, item.user.updated_at if item.user else None]
+    return make_etag(*parts)
+
+
+# 返回内容与token有关 需要Vary: Authorization
+def conditional_headers(etag, last_modified=None):
+    headers = {'ETag': '"{}"'.format(etag), 'Vary': 'Authorization'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+# 客户端缓存仍然有效时返回True 优先判断If-None-Match
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+
+# 逐行读取NDJSON 返回 (行号, 数据, 错误)，空行跳过
+# 超过max_line字节的行不解析 读取到该行结尾后返回错误
+def iter_ndjson(stream, max_line=64 * 1024):
+    line_number = 0
+    while True:
+        line = stream.readline(max_line + 1)
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_line:
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line)
+            yield line_number, None, {'_line': ['Line is too long.']}
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line), None
+        except ValueError:
+            yield line_number, None, {'_line': ['Invalid JSON.']}
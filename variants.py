@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from PIL import Image
+
+from cache import SingleFlight
+
+
+# 图像变体(限制宽度 JPEG或WebP)的磁盘缓存 文件名为变体key
+# 总大小超过max_bytes时按最后使用时间删除最旧的文件 直到低于max_bytes的90%
+# 命中时更新文件的mtime作为最后使用时间 距上次更新不足TOUCH_INTERVAL秒时不更新
+# 多个进程共用目录时 每个进程分别累计写入的大小 超出时重新扫描目录得到实际大小
+class VariantCache:
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.single_flight = SingleFlight()
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key[:2], '{}.{}'.format(key, extension))
+
+    # 返回变体文件的路径 不存在时调用create(临时文件路径)生成
+    # 并发的相同请求只生成一次
+    def get(self, key, extension, create):
+        path = self.path(key, extension)
+        try:
+            if os.stat(path).st_mtime < time.time() - self.TOUCH_INTERVAL:
+                os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        return self.single_flight.do(path, lambda: self._create(path, create))
+
+    def _create(self, path, create):
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        try:
+            create(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def _added(self, size):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry[1] for entry in self._scan())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    # (mtime, 大小, 路径) 不包括正在写入的临时文件
+    def _scan(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+# 源文件变化(修改时间或大小)后key随之变化
+def variant_key(source_path, width, fmt):
+    stat = os.stat(source_path)
+    data = '{}:{}:{}:{}:{}'.format(os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size, width, fmt)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+# 宽度不超过width 保持横纵比 不放大
+def make_variant(source_path, target_path, width, fmt):
+    with Image.open(source_path) as image:
+        # JPEG在解码时直接缩小 不解码完整分辨率的位图
+        if image.format == 'JPEG' and image.width > width:
+            image.draft('RGB', (width, max(1, image.height * width // image.width)))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.width > width:
+            image.thumbnail((width, image.height))
+        if fmt == 'webp':
+            image.save(target_path, 'WEBP', quality=80)
+        else:
+            image.save(target_path, 'JPEG', optimize=True, quality=80)